@@ -1,54 +1,384 @@
 import pandas as pd
+from pandas.api.types import union_categoricals
 import os
+import hashlib
+import bisect
+import io
+import time
+import json
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 import sqlite3
 import numpy as np
 import plotly.express as px
 import matplotlib.pyplot as plt
 from sklearn.linear_model import LinearRegression
 
+#numba is optional. When it is installed the cleaning loops that cannot be written as whole array operations are
+#compiled to machine code, otherwise they run as plain python and numpy. This is checked once when the code starts
+try:
+    from numba import njit
+    CLEANING_BACKEND = "numba"
+except ImportError:
+    njit = None
+    CLEANING_BACKEND = "numpy"
+
 #base path is the path on my computer to the directory in which there are folders that hold the database, data files, and this code
 
-def read_directory_to_df(directory_path):
+def file_name_to_hour(file_name):
+    #the price files are named after the hour they were scraped in, e.g. 2023-10-16--05.csv
+    try:
+        return datetime.strptime(file_name[:-4], "%Y-%m-%d--%H")
+    except ValueError:
+        return None
+
+def list_csv_files(directory_path, start=None, end=None):
+    #gives a list of the names of files in a directory and keeps only the csv files
+    #the names are sorted so the hourly files are always read in date order
+    start = pd.to_datetime(start) if start is not None else None
+    end = pd.to_datetime(end) if end is not None else None
+    csv_files = []
+    for file in os.listdir(directory_path):
+        if file.endswith(".csv"):
+            #files whose hour is completely outside of the date range are skipped without opening them
+            file_hour = file_name_to_hour(file)
+            if file_hour is not None:
+                if end is not None and file_hour > end:
+                    continue
+                if start is not None and file_hour + pd.Timedelta(hours=1) <= start:
+                    continue
+            csv_files.append(file)
+    csv_files.sort()
+    return csv_files
+
+def filter_prices(df, start=None, end=None, items=None):
+    #the files at the edges of the date range can still have some rows outside of it so the rows are checked as well
+    mask = np.ones(len(df), dtype=bool)
+    if start is not None:
+        mask &= (df['Date_time'] >= pd.to_datetime(start)).values
+    if end is not None:
+        mask &= (df['Date_time'] <= pd.to_datetime(end)).values
+    if items is not None:
+        mask &= df['Item_name'].isin(items).values
+    if mask.all():
+        return df
+    return df[mask].reset_index(drop=True)
+
+def parse_price_file(file_path):
+    with open(file_path, 'r') as file:
+        text = file.read()
+    lines = text.split('\n', 2)
+    #if the file only has a header (or nothing at all) there is no snapshot in it
+    if len(lines) < 2 or not lines[1].strip():
+        return None
+    
+    #every row in a file is from the same snapshot so the date and time are only converted once, from the first row
+    #if the first row cannot be read the hour in the file name (e.g. 2023-10-16--05.csv) is used instead
     try:
-        all_data = []
-        #gives a list of the names of files in a directory
-        files = os.listdir(directory_path)
+        name, date, delay, price, time = lines[1].strip().split(',')
+        snapshot_time = datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        snapshot_time = datetime.strptime(os.path.basename(file_path)[:-4], "%Y-%m-%d--%H")
+    
+    #only the name and price columns are read, with fixed types so pandas does not have to guess them
+    df = pd.read_csv(io.StringIO(text), usecols=['chem', 'price'], dtype={'chem': 'category', 'price': 'int32'})
+    return df['chem'].values, np.datetime64(snapshot_time, 'ns'), df['price'].values
+
+def read_price_file(file_path):
+    parsed = parse_price_file(file_path)
+    if parsed is None:
+        return pd.DataFrame({'Item_name': pd.Categorical([]), 'Date_time': np.array([], dtype='datetime64[ns]'), 'Price': np.array([], dtype=np.int32)})
+    names, snapshot_time, prices = parsed
+    df = pd.DataFrame({'Item_name': names, 'Date_time': np.repeat(snapshot_time, len(prices)), 'Price': prices})
+    return df
+
+def read_directory_to_df(directory_path, start=None, end=None, items=None):
+    try:
+        all_names = []
+        all_times = []
+        all_prices = []
         #stores all of the files in the given directory that is a csv file
-        csv_files = []
-        for file in files:
-            if file.endswith(".csv"):
-                csv_files.append(file)
+        csv_files = list_csv_files(directory_path, start, end)
         
         #if there are no csv files in the directory, it tells the user
         if not csv_files:
             print(f"No csv files found in {directory_path}")
             return None
         
-        #iterates through each of the files in csv_files array 
+        #iterates through each of the files in csv_files array and keeps the columns from each one
         for file_name in csv_files:
             file_path = os.path.join(directory_path, file_name)
-            with open(file_path, 'r') as file:
-                lines = file.readlines()[1:]  #skips the header of the file
-                records = []
-                for line in lines:
-                    if line.strip():
-                        name, date, delay, price, time = line.strip().split(',') #takes the values in each record and appends them to an array
-                        records.append([name, f"{date} {time}", int(price)])
-                df = pd.DataFrame(records, columns=['Item_name', 'Date_time', 'Price']) #the array is turneds into a dataframe
-                df['Date_time'] = pd.to_datetime(df['Date_time']) #converts the Date_time into a datetime type
-            all_data.append(df)
-        
-        combined_data = pd.concat(all_data, ignore_index=True)
-        combined_data['Date_time'] = pd.to_datetime(combined_data['Date_time'])
-        return combined_data
+            parsed = parse_price_file(file_path)
+            if parsed is None:
+                continue
+            names, snapshot_time, prices = parsed
+            all_names.append(names)
+            all_times.append(np.repeat(snapshot_time, len(prices)))
+            all_prices.append(prices)
+        
+        #the columns are joined once, the dates are already datetimes so they do not need converting again
+        combined_data = pd.DataFrame({
+            'Item_name': union_categoricals(all_names),
+            'Date_time': np.concatenate(all_times),
+            'Price': np.concatenate(all_prices)})
+        return filter_prices(combined_data, start, end, items)
     except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
         print(f"Error reading directory: {e}")
         return None
 
+def parse_price_files(file_paths):
+    #this runs inside a worker process so it only sends back plain numpy arrays, which are small and quick to pickle
+    item_codes = {}
+    codes = []
+    times = []
+    prices = []
+    for file_path in file_paths:
+        parsed = parse_price_file(file_path)
+        if parsed is None:
+            continue
+        names, snapshot_time, file_prices = parsed
+        #each item name is given a number so only one copy of every name is sent back
+        file_to_batch = np.array([item_codes.setdefault(name, len(item_codes)) for name in names.categories], dtype=np.int32)
+        codes.append(file_to_batch[names.codes])
+        times.append(np.repeat(snapshot_time.astype(np.int64), len(file_prices)))
+        prices.append(file_prices)
+    return {"Item_names": list(item_codes),
+            "Item_codes": np.concatenate(codes) if codes else np.array([], dtype=np.int32),
+            "Date_time": np.concatenate(times) if times else np.array([], dtype=np.int64),
+            "Price": np.concatenate(prices) if prices else np.array([], dtype=np.int32)}
+
+def read_directory_parallel(directory_path, workers=None, files_per_batch=50, start=None, end=None, items=None):
+    try:
+        csv_files = list_csv_files(directory_path, start, end)
+        if not csv_files:
+            print(f"No csv files found in {directory_path}")
+            return None
+        
+        #the files are split into batches so each worker gets a decent amount of work for every task it is sent
+        file_paths = [os.path.join(directory_path, file_name) for file_name in csv_files]
+        batches = [file_paths[i:i + files_per_batch] for i in range(0, len(file_paths), files_per_batch)]
+        
+        #workers defaults to None which lets the pool use one process per cpu core
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(parse_price_files, batches))
+        
+        #each batch numbered its items on its own, so the numbers are mapped onto one shared list of names
+        all_codes = {}
+        codes = []
+        for result in results:
+            batch_to_all = np.array([all_codes.setdefault(name, len(all_codes)) for name in result["Item_names"]], dtype=np.int32)
+            codes.append(batch_to_all[result["Item_codes"]])
+        
+        #the arrays are joined once at the end rather than concatenating a dataframe for every file
+        combined_data = pd.DataFrame({
+            'Item_name': pd.Categorical.from_codes(np.concatenate(codes), categories=list(all_codes)),
+            'Date_time': np.concatenate([result["Date_time"] for result in results]).astype('datetime64[ns]'),
+            'Price': np.concatenate([result["Price"] for result in results])})
+        return filter_prices(combined_data, start, end, items)
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error reading directory in parallel: {e}")
+        return None
+
+def iter_price_batches(directory_path, batch_rows=10000, start=None, end=None, items=None):
+    #yields the rows from the directory a batch at a time so only one batch is ever held in memory
+    start = pd.to_datetime(start) if start is not None else None
+    end = pd.to_datetime(end) if end is not None else None
+    items = set(items) if items is not None else None
+    batch = []
+    for file_name in list_csv_files(directory_path, start, end):
+        parsed = parse_price_file(os.path.join(directory_path, file_name))
+        if parsed is None:
+            continue
+        names, snapshot_time, prices = parsed
+        snapshot_time = pd.Timestamp(snapshot_time)
+        #the whole file is in or out of the date range because all of its rows have the same time
+        if (start is not None and snapshot_time < start) or (end is not None and snapshot_time > end):
+            continue
+        #the time is turned into the same text that to_sql stores, once per file
+        date_time = snapshot_time.strftime("%Y-%m-%d %H:%M:%S")
+        for name, price in zip(names, prices.tolist()):
+            if items is None or name in items:
+                batch.append((name, date_time, price))
+                if len(batch) == batch_rows:
+                    yield batch
+                    batch = []
+    #the last batch is usually smaller than the rest
+    if batch:
+        yield batch
+
+def write_batches_to_db(batches, db_path, table_name, if_exists="replace"):
+    try:
+        conn = connect_db(db_path)
+        rows_written = 0
+        #everything is written in one transaction so a failed rebuild leaves the old table as it was
+        with conn:
+            if if_exists == "replace":
+                conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+            check_snapshot_times(conn, table_name)
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {table_name} ("Item_name" TEXT, "Date_time" TIMESTAMP, "Price" INTEGER)')
+            make_price_index_unique(conn, table_name)
+            #each batch is inserted and then dropped before the next one is read
+            for batch in batches:
+                conn.executemany(f"INSERT OR REPLACE INTO {table_name} (Item_name, Date_time, Price) VALUES (?, ?, ?)", batch)
+                rows_written += len(batch)
+        conn.close()
+        return rows_written
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error writing batches to database: {e}")
+        return None
+
+def file_fingerprint(file_path):
+    #the size and modified time are cheap to get so they are checked first, the hash is only needed if they have changed
+    file_stats = os.stat(file_path)
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        file_hash.update(file.read())
+    return file_stats.st_size, file_stats.st_mtime, file_hash.hexdigest()
+
+def ingest_new_files(directory_path, db_path, table_name="Market_prices", manifest_table="Processed_files", file_names=None):
+    #gives the number of new rows that were put into the database
+    ingested = ingest_changed_files(directory_path, db_path, table_name, manifest_table, file_names)
+    if ingested is None:
+        return None
+    ingested_files, changed_from = ingested
+    return sum(ingested_files.values())
+
+def ingest_changed_files(directory_path, db_path, table_name="Market_prices", manifest_table="Processed_files", file_names=None):
+    #puts every new or changed file into the database and gives back the name of each file that was read with its number of rows
+    #(the files that were already in the database are not in it), and the earliest time each item's prices changed at.
+    #the changed times are also saved in Changed_prices so update_cleaned_tail cleans again from there, which matters when
+    #a late file adds prices before the latest cleaned one or a changed file replaces prices that were already cleaned
+    try:
+        conn = connect_db(db_path)
+        check_snapshot_times(conn, table_name)
+        #the prices table is created with the same columns that to_sql would give it so both ways of writing can be mixed
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {table_name} ("Item_name" TEXT, "Date_time" TIMESTAMP, "Price" INTEGER)')
+        make_price_index_unique(conn, table_name)
+        #the manifest remembers every file that has already been put into the database and the snapshot time its rows were
+        #stored at, so that if the file is changed its old rows can be found even if the time in the file has changed
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {manifest_table} ("File_name" TEXT PRIMARY KEY, "Size" INTEGER, "Mtime" REAL, "Hash" TEXT, "Snapshot_time" TEXT)')
+        #manifests made before the snapshot time was stored get the column added, with no time for the files already in them
+        if "Snapshot_time" not in [column[1] for column in conn.execute(f"PRAGMA table_info({manifest_table})")]:
+            conn.execute(f'ALTER TABLE {manifest_table} ADD COLUMN "Snapshot_time" TEXT')
+        conn.commit()
+        
+        manifest = {}
+        for file_name, size, mtime, file_hash, snapshot_time in conn.execute(f"SELECT File_name, Size, Mtime, Hash, Snapshot_time FROM {manifest_table}"):
+            manifest[file_name] = (size, mtime, file_hash, snapshot_time)
+        
+        new_rows = []
+        old_snapshots = []
+        manifest_rows = []
+        ingested_files = {}
+        #file names can be passed in to only check those files, otherwise the whole directory is checked
+        if file_names is None:
+            file_names = list_csv_files(directory_path)
+        for file_name in file_names:
+            file_path = os.path.join(directory_path, file_name)
+            try:
+                file_stats = os.stat(file_path)
+                #if the size and modified time have not changed the file does not need to be opened
+                if file_name in manifest and manifest[file_name][:2] == (file_stats.st_size, file_stats.st_mtime):
+                    continue
+                size, mtime, file_hash = file_fingerprint(file_path)
+            except FileNotFoundError:
+                #the file was moved or deleted after it was listed, so there is nothing to read
+                continue
+            #the file was touched but the contents are the same, so only the manifest needs updating
+            if file_name in manifest and manifest[file_name][2] == file_hash:
+                manifest_rows.append((file_name, size, mtime, file_hash, manifest[file_name][3]))
+                continue
+            
+            df = read_price_file(file_path)
+            date_times = df['Date_time'].dt.strftime("%Y-%m-%d %H:%M:%S")
+            snapshot_time = date_times.iloc[0] if len(df) else None
+            #a changed file replaces the rows that were read from it last time, found by the time they were stored at
+            if file_name in manifest:
+                stored_time = manifest[file_name][3]
+                if stored_time is not None:
+                    old_snapshots.append((stored_time, stored_time))
+                else:
+                    #a file from before the snapshot time was stored, every row in the hour of its name is its row
+                    file_hour = file_name_to_hour(file_name)
+                    if file_hour is not None:
+                        old_snapshots.append((file_hour.strftime("%Y-%m-%d %H:%M:%S"), (file_hour + pd.Timedelta(hours=1) - pd.Timedelta(seconds=1)).strftime("%Y-%m-%d %H:%M:%S")))
+                    elif snapshot_time is not None:
+                        old_snapshots.append((snapshot_time, snapshot_time))
+            new_rows.extend(zip(df['Item_name'].astype(str), date_times, df['Price'].astype(int)))
+            manifest_rows.append((file_name, size, mtime, file_hash, snapshot_time))
+            ingested_files[file_name] = len(df)
+        
+        #every item in a new file changes from the earliest time it has in the new files
+        changed_from = {}
+        for item, date_time, price in new_rows:
+            if item not in changed_from or date_time < changed_from[item]:
+                changed_from[item] = date_time
+        
+        #all of the changes are written in one transaction so the database is never left half updated
+        with conn:
+            #the item names are listed through the (item, date) index so each delete is one index lookup per item
+            #rather than a scan of the whole table
+            for first_time, last_time in old_snapshots:
+                #the items whose old rows are deleted change too, even if they are not in the new version of the file
+                for item, date_time in conn.execute(f"{item_names_query(table_name)} SELECT Item_name, MIN(Date_time) FROM {table_name} "
+                                                    f"WHERE Item_name IN (SELECT Item_name FROM names) AND Date_time BETWEEN ? AND ? GROUP BY Item_name",
+                                                    (first_time, last_time)).fetchall():
+                    changed_from[item] = min(date_time, changed_from.get(item, date_time))
+                conn.execute(f"{item_names_query(table_name)} DELETE FROM {table_name} WHERE Item_name IN (SELECT Item_name FROM names) "
+                             f"AND Date_time BETWEEN ? AND ?", (first_time, last_time))
+            conn.executemany(f"INSERT OR REPLACE INTO {table_name} (Item_name, Date_time, Price) VALUES (?, ?, ?)", new_rows)
+            conn.executemany(f"INSERT OR REPLACE INTO {manifest_table} (File_name, Size, Mtime, Hash, Snapshot_time) VALUES (?, ?, ?, ?, ?)", manifest_rows)
+            record_changed_prices(conn, table_name, changed_from)
+        conn.close()
+        
+        print(f"Ingested {len(new_rows)} new rows from {directory_path}")
+        return ingested_files, changed_from
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error ingesting new files: {e}")
+        return None
+
+
+def record_changed_prices(conn, table_name, changed_from):
+    #keeps the earliest time that each item's prices in a table have changed at since they were last used, so whatever is
+    #worked out from the table (the cleaned prices, the trend totals) can be worked out again from that time onwards
+    conn.execute('CREATE TABLE IF NOT EXISTS Changed_prices ("Table_name" TEXT, "Item_name" TEXT, "Changed_from" TEXT, PRIMARY KEY ("Table_name", "Item_name"))')
+    conn.executemany("INSERT INTO Changed_prices (Table_name, Item_name, Changed_from) VALUES (?, ?, ?) "
+                     "ON CONFLICT (Table_name, Item_name) DO UPDATE SET Changed_from = MIN(Changed_from, excluded.Changed_from)",
+                     [(table_name, item, date_time) for item, date_time in changed_from.items()])
+
+def read_changed_prices(conn, table_name):
+    conn.execute('CREATE TABLE IF NOT EXISTS Changed_prices ("Table_name" TEXT, "Item_name" TEXT, "Changed_from" TEXT, PRIMARY KEY ("Table_name", "Item_name"))')
+    return dict(conn.execute("SELECT Item_name, Changed_from FROM Changed_prices WHERE Table_name = ?", (table_name,)).fetchall())
+
+def clear_changed_prices(conn, table_name, used_changes):
+    #only the changes that have been used are cleared, if the time has moved earlier since they were read it is kept
+    conn.executemany("DELETE FROM Changed_prices WHERE Table_name = ? AND Item_name = ? AND Changed_from = ?",
+                     [(table_name, item, date_time) for item, date_time in used_changes.items()])
+
+def connect_db(db_path):
+    conn = sqlite3.connect(db_path) # connects to the database from the given path
+    #in WAL mode the front end can keep reading the database while the backend is writing to it
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
 
 def write_df_to_db(df, db_path, table_name, if_exists="replace"):
     try:
-        conn = sqlite3.connect(db_path) # connects to the database from the given path
+        conn = connect_db(db_path)
+        snapshot_times = has_snapshot_times(df['Date_time']) if 'Date_time' in df.columns else False
+        with conn:
+            if if_exists == "replace":
+                #the table is listed as using snapshot times only if the rows being written use them
+                conn.execute('CREATE TABLE IF NOT EXISTS Snapshot_time_tables ("Table_name" TEXT PRIMARY KEY)')
+                conn.execute("DELETE FROM Snapshot_time_tables WHERE Table_name = ?", (table_name,))
+                if snapshot_times:
+                    conn.execute("INSERT INTO Snapshot_time_tables (Table_name) VALUES (?)", (table_name,))
+            else:
+                #rows added to a table have to use the same kind of times as the rows already in it
+                check_snapshot_times(conn, table_name)
+                if not snapshot_times:
+                    raise ValueError(f"the rows have one time per row from the old reader, they cannot be added to {table_name}")
         df.to_sql(table_name, conn, if_exists=if_exists, index=False) #writes the dataframe into the sql table
         conn.close()
         return True
@@ -57,6 +387,42 @@ def write_df_to_db(df, db_path, table_name, if_exists="replace"):
         print(f"Error writing to database: {e}")
         return False
     
+def upsert_df_to_db(df, db_path, table_name, on_conflict="replace", batch_rows=10000):
+    try:
+        #on_conflict "replace" overwrites a price that is already stored for that item and time, "ignore" keeps the stored one
+        if on_conflict == "replace":
+            insert = "INSERT OR REPLACE"
+        elif on_conflict == "ignore":
+            insert = "INSERT OR IGNORE"
+        else:
+            raise ValueError(f"Unknown on_conflict {on_conflict}")
+        
+        #cleaned prices are not whole numbers so they are stored as REAL
+        price_type = "REAL" if pd.api.types.is_float_dtype(df['Price']) else "INTEGER"
+        names = df['Item_name'].astype(str).tolist()
+        date_times = df['Date_time'].dt.strftime("%Y-%m-%d %H:%M:%S").tolist()
+        #a missing price (nan, or NA in the nullable Int32 the price ladder gives) is stored as null
+        prices = df['Price'].astype(object).where(df['Price'].notna(), None).tolist()
+        
+        conn = connect_db(db_path)
+        #the table is changed in place in one transaction rather than being dropped and written again
+        with conn:
+            check_snapshot_times(conn, table_name)
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {table_name} ("Item_name" TEXT, "Date_time" TIMESTAMP, "Price" {price_type})')
+            make_price_index_unique(conn, table_name)
+            for i in range(0, len(names), batch_rows):
+                conn.executemany(f"{insert} INTO {table_name} (Item_name, Date_time, Price) VALUES (?, ?, ?)",
+                                 zip(names[i:i + batch_rows], date_times[i:i + batch_rows], prices[i:i + batch_rows]))
+            #the earliest time each item was written at is saved so anything worked out from this table is updated from there
+            if names:
+                earliest_times = pd.DataFrame({'Item_name': names, 'Date_time': date_times}).groupby('Item_name')['Date_time'].min()
+                record_changed_prices(conn, table_name, earliest_times.to_dict())
+        conn.close()
+        return True
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error upserting to database: {e}")
+        return False
+    
 def read_db_to_df(db_path, table_name):
     try:
         conn = sqlite3.connect(db_path)
@@ -72,6 +438,204 @@ def read_db_to_df(db_path, table_name):
         print(f"Error reading database: {e}")
         return None
 
+def create_price_index(conn, table_name="Market_prices"):
+    #an index on (item, date) lets sqlite jump straight to one item's prices and then to the dates asked for
+    #this is the same statement the front end uses, and it does nothing if the index (unique or not) is already there
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_item_time ON {table_name} (Item_name, Date_time)")
+
+def make_price_index_unique(conn, table_name="Market_prices"):
+    #the upserts need the (item, date) index to be unique so that each item can only have one price at each time.
+    #this is only called by the functions that write prices, never when reading. A table made before the index was
+    #unique can have duplicate rows, those are removed first (the last one written is kept) and the number is reported
+    index_name = f"idx_{table_name}_item_time"
+    for index in conn.execute(f"PRAGMA index_list({table_name})").fetchall():
+        if index[1] == index_name and index[2]:
+            return 0
+    removed = conn.execute(f"DELETE FROM {table_name} WHERE rowid NOT IN (SELECT MAX(rowid) FROM {table_name} GROUP BY Item_name, Date_time)").rowcount
+    if removed:
+        print(f"Removed {removed} duplicate rows from {table_name} before making its (Item_name, Date_time) index unique")
+    conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+    conn.execute(f"CREATE UNIQUE INDEX {index_name} ON {table_name} (Item_name, Date_time)")
+    return removed
+
+def table_exists(conn, table_name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone() is not None
+
+def has_snapshot_times(date_times):
+    #with snapshot times every row scraped in the same hour has the same time, the old reader gave the rows of one file
+    #times a second or two apart, so there is more than one time in most hours
+    date_times = pd.to_datetime(pd.Series(date_times))
+    return date_times.nunique() == date_times.dt.floor('h').nunique()
+
+def check_snapshot_times(conn, table_name):
+    #the old reader stored each row's own time, which can be a second or two different inside one file, but the files are
+    #now read with one time per snapshot. If new rows were written over a table from the old reader they would not match
+    #the old rows and every item-hour would be stored twice, so the tables that use snapshot times are listed and any other
+    #table that already has rows has to go through migrate_to_snapshot_times first
+    conn.execute('CREATE TABLE IF NOT EXISTS Snapshot_time_tables ("Table_name" TEXT PRIMARY KEY)')
+    if conn.execute("SELECT 1 FROM Snapshot_time_tables WHERE Table_name = ?", (table_name,)).fetchone():
+        return
+    if table_exists(conn, table_name) and conn.execute(f"SELECT 1 FROM {table_name} LIMIT 1").fetchone():
+        raise ValueError(f"{table_name} has one time per row from the old reader, run migrate_to_snapshot_times on it first")
+    #a new or empty table only ever gets snapshot times
+    conn.execute("INSERT INTO Snapshot_time_tables (Table_name) VALUES (?)", (table_name,))
+
+def migrate_to_snapshot_times(directory_path, db_path, table_name="Market_prices", cleaned_table="Cleaned_market_prices"):
+    #moves every row in a database made by the old reader to the snapshot time of the file it came from (the time of the
+    #first row), so that the incremental ingest and the upserts match the rows that are already there. Only rows whose
+    #own time is different are changed, and a row that was already ingested again at the snapshot time is replaced
+    try:
+        changes = []
+        for file_name in list_csv_files(directory_path):
+            file_path = os.path.join(directory_path, file_name)
+            parsed = parse_price_file(file_path)
+            if parsed is None:
+                continue
+            snapshot_time = pd.Timestamp(parsed[1]).strftime("%Y-%m-%d %H:%M:%S")
+            rows = pd.read_csv(file_path, usecols=['chem', 'date', 'time'], dtype=str)
+            #the times are put in the same text format the old reader stored them in
+            row_times = pd.to_datetime(rows['date'] + ' ' + rows['time'], format="%Y-%m-%d %H:%M:%S", errors='coerce').dt.strftime("%Y-%m-%d %H:%M:%S")
+            moved = (row_times != snapshot_time) & row_times.notna()
+            changes.extend(zip([snapshot_time] * int(moved.sum()), rows['chem'][moved], row_times[moved]))
+        
+        conn = connect_db(db_path)
+        #every table is moved in one transaction so the database is never left half moved
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS Snapshot_time_tables ("Table_name" TEXT PRIMARY KEY)')
+            for table in [table_name, cleaned_table]:
+                if not table_exists(conn, table):
+                    continue
+                make_price_index_unique(conn, table)
+                moved_rows = 0
+                for new_time, item, old_time in changes:
+                    moved_rows += conn.execute(f"UPDATE OR REPLACE {table} SET Date_time = ? WHERE Item_name = ? AND Date_time = ?", (new_time, item, old_time)).rowcount
+                conn.execute("INSERT OR IGNORE INTO Snapshot_time_tables (Table_name) VALUES (?)", (table,))
+                print(f"Moved {moved_rows} rows in {table} to their snapshot times")
+        conn.close()
+        return True
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error moving rows to snapshot times: {e}")
+        return False
+
+def query_prices(db_path, items=None, start=None, end=None, columns=None, table_name="Market_prices"):
+    try:
+        #only known column names are put into the query, everything else is passed in as a parameter
+        allowed_columns = ['Item_name', 'Date_time', 'Price']
+        if columns is None:
+            columns = allowed_columns
+        for column in columns:
+            if column not in allowed_columns:
+                raise ValueError(f"Unknown column {column}")
+        
+        conditions = []
+        params = []
+        if items is not None:
+            items = list(items)
+            if not items:
+                return pd.DataFrame(columns=columns)
+            conditions.append(f"Item_name IN ({', '.join('?' * len(items))})")
+            params.extend(items)
+        #the dates are stored as text in the same format so comparing the text gives the same order as comparing the dates
+        if start is not None:
+            conditions.append("Date_time >= ?")
+            params.append(pd.to_datetime(start).strftime("%Y-%m-%d %H:%M:%S"))
+        if end is not None:
+            conditions.append("Date_time <= ?")
+            params.append(pd.to_datetime(end).strftime("%Y-%m-%d %H:%M:%S"))
+        
+        query = f"SELECT {', '.join(columns)} FROM {table_name}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY Item_name, Date_time"
+        
+        conn = sqlite3.connect(db_path)
+        with conn:
+            create_price_index(conn, table_name)
+        df = pd.read_sql_query(query, conn, params=params) #only the rows and columns asked for are read out of the database
+        conn.close()
+        
+        if 'Date_time' in df.columns:
+            df['Date_time'] = pd.to_datetime(df['Date_time'], format="ISO8601")
+        return df
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error querying database: {e}")
+        return None
+
+def create_compact_schema(conn):
+    #each item name is only stored once in the items table and the prices table refers to it by its id
+    conn.execute("CREATE TABLE IF NOT EXISTS items (item_id INTEGER PRIMARY KEY, item_name TEXT NOT NULL UNIQUE)")
+    #the times are stored as whole seconds since 1970 and the table is kept in (item, time) order with no separate rowid
+    conn.execute("""CREATE TABLE IF NOT EXISTS prices (
+                        item_id INTEGER NOT NULL REFERENCES items (item_id),
+                        ts INTEGER NOT NULL,
+                        price INTEGER NOT NULL,
+                        PRIMARY KEY (item_id, ts)) WITHOUT ROWID""")
+
+def write_df_to_compact_db(df, db_path):
+    try:
+        conn = connect_db(db_path)
+        with conn:
+            create_compact_schema(conn)
+            #any items not seen before are added and then the id of every item is looked up
+            item_names = pd.unique(df['Item_name'].astype(str))
+            conn.executemany("INSERT OR IGNORE INTO items (item_name) VALUES (?)", [(name,) for name in item_names])
+            item_ids = dict(conn.execute("SELECT item_name, item_id FROM items"))
+            
+            ids = df['Item_name'].astype(str).map(item_ids).to_numpy(dtype=np.int64)
+            timestamps = df['Date_time'].values.astype('datetime64[s]').astype(np.int64)
+            prices = df['Price'].to_numpy(dtype=float)
+            #cleaned prices can be missing (nan) when there was nothing in their window, the prices are stored as whole
+            #numbers so a missing one cannot be stored and the row is left out rather than saved as a huge negative number
+            present = ~np.isnan(prices)
+            if not present.all():
+                print(f"Left out {int((~present).sum())} rows with no price when writing to the compact database")
+                ids, timestamps, prices = ids[present], timestamps[present], prices[present]
+            prices = np.rint(prices).astype(np.int64)
+            conn.executemany("INSERT OR REPLACE INTO prices (item_id, ts, price) VALUES (?, ?, ?)", zip(ids.tolist(), timestamps.tolist(), prices.tolist()))
+        conn.close()
+        return True
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error writing to compact database: {e}")
+        return False
+
+def migrate_to_compact_db(source_db_path, target_db_path, table_name="Market_prices", chunk_rows=100000):
+    try:
+        conn = sqlite3.connect(source_db_path)
+        rows_migrated = 0
+        #the old table is read a chunk at a time and the text dates are converted one last time on the way across
+        for chunk in pd.read_sql_query(f"SELECT Item_name, Date_time, Price FROM {table_name}", conn, chunksize=chunk_rows):
+            chunk['Date_time'] = pd.to_datetime(chunk['Date_time'], format="ISO8601")
+            if not write_df_to_compact_db(chunk, target_db_path):
+                conn.close()
+                return None
+            rows_migrated += len(chunk)
+        conn.close()
+        print(f"Migrated {rows_migrated} rows from {table_name} into {target_db_path}")
+        return rows_migrated
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error migrating database: {e}")
+        return None
+
+def read_compact_db_to_df(db_path):
+    try:
+        conn = sqlite3.connect(db_path)
+        items = pd.read_sql_query("SELECT item_id, item_name FROM items ORDER BY item_id", conn)
+        prices = pd.read_sql_query("SELECT item_id, ts, price FROM prices", conn)
+        conn.close()
+        
+        #the item ids are turned into category codes with a lookup array so no strings have to be built for each row
+        id_to_code = np.full(items['item_id'].max() + 1 if len(items) else 1, -1, dtype=np.int32)
+        id_to_code[items['item_id'].values] = np.arange(len(items), dtype=np.int32)
+        df = pd.DataFrame({
+            'Item_name': pd.Categorical.from_codes(id_to_code[prices['item_id'].values], categories=items['item_name'].tolist()),
+            #the seconds are read straight into a datetime array, there is no text to parse
+            'Date_time': prices['ts'].values.astype('datetime64[s]').astype('datetime64[ns]'),
+            'Price': prices['price'].values.astype(np.int32)})
+        return df
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error reading compact database: {e}")
+        return None
+
 def calculate_stats(prices, index, window_size=25):
     #defines the start and end of the window
     if index - window_size < 0:
@@ -111,43 +675,864 @@ def clean_group(prices):
     
     return prices
 
-def clean_all_data(df):
+def window_bounds(length, window_size=10):
+    #the same start and end as calculate_stats, worked out for every index at once
+    index = np.arange(length)
+    starts = np.maximum(index - window_size, 0)
+    ends = np.minimum(index + window_size + 1, length)
+    return starts, ends
+
+def window_bounds_by_duration(date_times, window_duration):
+    #the window is every point within window_duration either side in time, rather than a number of points either side,
+    #so a gap in the scraping makes the window hold fewer points instead of reaching further back and forward
+    #the times must be sorted, then two searchsorteds find every start and end at once
+    times = np.asarray(date_times, dtype='datetime64[ns]')
+    window_duration = pd.Timedelta(window_duration).to_timedelta64()
+    starts = np.searchsorted(times, times - window_duration, side='left')
+    ends = np.searchsorted(times, times + window_duration, side='right')
+    return starts, ends
 
+def running_totals(values):
+    #running totals down the first axis with a row of zeros on top, so the total of rows start to end is totals[end] - totals[start]
+    #missing prices (nan) count as nothing, so a 2d array of items with gaps is handled the same as one item with no gaps
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    zero_row = np.zeros((1,) + values.shape[1:])
+    sums = np.concatenate((zero_row, np.cumsum(filled, axis=0)))
+    counts = np.concatenate((zero_row, np.cumsum(present, axis=0)))
+    return filled, present, sums, counts
+
+def rolling_mean_excluding_centre(prices, window_size=10, bounds=None):
+    values = np.asarray(prices, dtype=float)
+    starts, ends = bounds if bounds is not None else window_bounds(len(values), window_size)
+    #the running total means the sum of any window is one subtraction, then the centre point is taken off
+    filled, present, sums, counts = running_totals(values)
+    window_counts = counts[ends] - counts[starts] - present
+    #a series with only one price has nothing in its window, which gives nan like np.mean of an empty list
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums[ends] - sums[starts] - filled) / window_counts
+
+def clean_prices_centered(prices, window_size=10, cap=5000, bounds=None):
+    #every point is given the mean of the raw prices around it, capped at the maximum a chemistry price can be
+    local_means = rolling_mean_excluding_centre(prices, window_size, bounds)
+    return np.where(local_means > cap, cap, local_means)
+
+def compile_kernel(kernel):
+    #gives the numba compiled version of a kernel if numba is installed, the kernel is only compiled the first time it runs
+    return njit(kernel) if CLEANING_BACKEND == "numba" else None
+
+def legacy_smoothing_kernel(values, starts, ends, cap, start_index):
+    #the loop behind smooth_prices_legacy, it smooths values in place from start_index onwards. It is written so the same
+    #code runs on python lists (which python loops over fastest) and on numpy arrays when it is compiled by numba
+    length = len(values)
+    #a point with nothing in its window is smoothed to nan, like np.mean of an empty list, and it is then left out of
+    #the windows after it so that one empty window does not turn the running sum into nan for the rest of the series
+    left_missing = 0
+    left_sum = 0.0
+    for leaving in range(starts[start_index], start_index):
+        if values[leaving] == values[leaving]:
+            left_sum += values[leaving]
+        else:
+            left_missing += 1
+    right_sum = 0.0
+    for joining in range(start_index + 1, ends[start_index]):
+        right_sum += values[joining]
+    for index in range(start_index, length):
+        count = ends[index] - starts[index] - 1 - left_missing
+        local_mean = (left_sum + right_sum) / count if count > 0 else np.nan
+        
+        #same rule as clean_group, cap at 5000 otherwise use the mean
+        if local_mean > cap:
+            values[index] = cap
+        else:
+            values[index] = local_mean
+        
+        #move both sides of the window along to the next point, the starts and ends only ever move forwards
+        if index + 1 < length:
+            if values[index] == values[index]:
+                left_sum += values[index]
+            else:
+                left_missing += 1
+            for leaving in range(starts[index], starts[index + 1]):
+                if values[leaving] == values[leaving]:
+                    left_sum -= values[leaving]
+                else:
+                    left_missing -= 1
+            for joining in range(ends[index], ends[index + 1]):
+                right_sum += values[joining]
+            right_sum -= values[index + 1]
+    return values
+
+legacy_smoothing_kernel_compiled = compile_kernel(legacy_smoothing_kernel)
+
+def smooth_prices_legacy(prices, window_size=10, cap=5000, start_index=0, bounds=None):
+    #clean_group writes each smoothed price back into the list before moving on, so the left of every window is
+    #already smoothed and the right is still raw. The two sides are kept as running sums so each point is O(1)
+    #the prices before start_index are taken as already smoothed, so only the tail after them is worked out
+    values = np.array(prices, dtype=float)
+    length = len(values)
+    starts, ends = bounds if bounds is not None else window_bounds(length, window_size)
+    if start_index >= length:
+        return values
+    if legacy_smoothing_kernel_compiled is not None:
+        return legacy_smoothing_kernel_compiled(values, np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64), float(cap), start_index)
+    return np.array(legacy_smoothing_kernel(values.tolist(), np.asarray(starts).tolist(), np.asarray(ends).tolist(), cap, start_index))
+
+def smooth_prices(prices, window_size=10, mode="legacy", cap=5000, bounds=None):
+    #legacy gives the same results as clean_group, centered uses the raw prices on both sides of every point
+    if mode == "legacy":
+        return smooth_prices_legacy(prices, window_size, cap, bounds=bounds)
+    if mode == "centered":
+        return clean_prices_centered(prices, window_size, cap, bounds)
+    raise ValueError(f"Unknown smoothing mode {mode}")
+
+class SortedWindow:
+    #keeps the prices in a rolling window in sorted order, so the median can be read straight off the middle.
+    #bisect finds where a price goes in O(log w) comparisons, but making room for it (or closing the gap when one is removed)
+    #shifts the rest of the list along, which is O(w). So the filter is O(n * w) overall rather than O(n log w), but the
+    #shift is a single memmove of w pointers, which for windows of a few dozen prices is quicker in python than the
+    #extra work of keeping a skip list or two heaps
+    def __init__(self):
+        self.values = []
+    
+    def add(self, value):
+        #a missing price (nan) cannot be put in order, so it is left out of the window
+        if value != value:
+            return
+        bisect.insort(self.values, value)
+    
+    def remove(self, value):
+        if value != value:
+            return
+        del self.values[bisect.bisect_left(self.values, value)]
+    
+    def median(self):
+        #a window with no prices in it has no median, like np.median of an empty list
+        if not self.values:
+            return float("nan")
+        middle = len(self.values) // 2
+        if len(self.values) % 2:
+            return self.values[middle]
+        return (self.values[middle - 1] + self.values[middle]) / 2
+    
+    def kth_distance(self, centre, k):
+        #the distances from the centre are two sorted lists, going left and going right from where the centre sits,
+        #so the k-th smallest distance is found by binary searching how many of them come from the left side
+        values = self.values
+        split = bisect.bisect_left(values, centre)
+        left_count = split
+        right_count = len(values) - split
+        left = lambda j: centre - values[split - 1 - j]
+        right = lambda j: values[split + j] - centre
+        low = max(0, k + 1 - right_count)
+        high = min(k + 1, left_count)
+        while low < high:
+            taken = (low + high) // 2
+            #if the next left distance is smaller than the last right one being used, more should come from the left
+            if left(taken) < right(k - taken):
+                low = taken + 1
+            else:
+                high = taken
+        taken = low
+        candidates = []
+        if taken > 0:
+            candidates.append(left(taken - 1))
+        if k - taken >= 0:
+            candidates.append(right(k - taken))
+        return max(candidates)
+    
+    def mad(self, centre):
+        #median absolute deviation from the centre
+        size = len(self.values)
+        if size == 0:
+            return float("nan")
+        if size % 2:
+            return self.kth_distance(centre, size // 2)
+        return (self.kth_distance(centre, size // 2 - 1) + self.kth_distance(centre, size // 2)) / 2
+
+def hampel_filter(prices, window_size=10, threshold=3.0, bounds=None):
+    #replaces a price with the median of its window when it is more than threshold scaled MADs away from it
+    #the median and MAD are not pulled around by one off spikes like the mean and standard deviation are
+    values = np.asarray(prices, dtype=float)
+    cleaned = values.copy()
+    length = len(values)
+    starts, ends = bounds if bounds is not None else window_bounds(length, window_size)
+    starts = np.asarray(starts).tolist()
+    ends = np.asarray(ends).tolist()
+    window = SortedWindow()
+    if length:
+        for value in values[starts[0]:ends[0]].tolist():
+            window.add(value)
+    for index in range(length):
+        local_median = window.median()
+        #1.4826 scales the MAD so it is comparable to a standard deviation
+        local_mad = 1.4826 * window.mad(local_median)
+        if abs(values[index] - local_median) > threshold * local_mad:
+            cleaned[index] = local_median
+        
+        #move the window along to the next point
+        if index + 1 < length:
+            for joining in range(ends[index], ends[index + 1]):
+                window.add(values[joining])
+            for leaving in range(starts[index], starts[index + 1]):
+                window.remove(values[leaving])
+    return cleaned
+
+def rolling_mean_std_excluding_centre(prices, window_size=10, bounds=None):
+    values = np.asarray(prices, dtype=float)
+    starts, ends = bounds if bounds is not None else window_bounds(len(values), window_size)
+    #the prices are shifted by the first price before they are squared so the running totals stay small,
+    #otherwise taking away two big totals to get the variance would lose most of the precision
+    shift = 0.0
+    if len(values):
+        first_present = np.expand_dims((~np.isnan(values)).argmax(axis=0), 0)
+        shift = np.nan_to_num(np.take_along_axis(values, first_present, axis=0)[0])
+    shifted, present, sums, counts = running_totals(values - shift)
+    squares = running_totals(shifted * shifted)[2]
+    window_counts = counts[ends] - counts[starts] - present
+    with np.errstate(invalid="ignore", divide="ignore"):
+        local_means = (sums[ends] - sums[starts] - shifted) / window_counts
+        local_variances = (squares[ends] - squares[starts] - shifted * shifted) / window_counts - local_means * local_means
+    #rounding can leave a variance a tiny bit below zero when every price in the window is the same
+    local_variances = np.maximum(local_variances, 0.0)
+    return local_means + shift, np.sqrt(local_variances)
+
+def average_ignoring_missing(first, second):
+    #the average of two arrays where a missing (nan) value is left out, nan only if both are missing
+    total = np.nan_to_num(first) + np.nan_to_num(second)
+    count = (~np.isnan(first)).astype(float) + (~np.isnan(second))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return total / count
+
+def neighbour_average(prices):
+    #the average of the points either side, or of the two next to it at the ends of the series
+    values = np.asarray(prices, dtype=float)
+    averages = values.copy()
+    if len(values) >= 3:
+        averages[1:-1] = average_ignoring_missing(values[:-2], values[2:])
+        averages[0] = average_ignoring_missing(values[1], values[2])
+        averages[-1] = average_ignoring_missing(values[-2], values[-3])
+    elif len(values) == 2:
+        averages = values[::-1].copy()
+    #if there are no neighbours to average the point keeps its own price
+    return np.where(np.isnan(averages), values, averages)
+
+def sigma_replace_kernel(values, local_means, local_stds, sigmas, cap):
+    #the same rules as the numpy part of sigma_clip written as one loop, so numba can do it in a single pass
+    #without making the flagged and neighbour arrays
+    length = len(values)
+    cleaned = values.copy()
+    for index in range(length):
+        value = values[index]
+        if value > cap:
+            cleaned[index] = cap
+        elif value < local_means[index] - sigmas * local_stds[index] or value > local_means[index] + sigmas * local_stds[index]:
+            #the average of the points either side, or of the two next to it at the ends of the series
+            if length >= 3:
+                if index == 0:
+                    first, second = values[1], values[2]
+                elif index == length - 1:
+                    first, second = values[length - 2], values[length - 3]
+                else:
+                    first, second = values[index - 1], values[index + 1]
+            elif length == 2:
+                first, second = values[1 - index], values[1 - index]
+            else:
+                first, second = np.nan, np.nan
+            if first != first:
+                average = second
+            elif second != second:
+                average = first
+            else:
+                average = (first + second) / 2
+            #if there are no neighbours to average the point keeps its own price
+            if average != average:
+                average = value
+            cleaned[index] = cap if average > cap else average
+    return cleaned
+
+sigma_replace_kernel_compiled = compile_kernel(sigma_replace_kernel)
+
+def sigma_clip(prices, window_size=10, sigmas=2.0, cap=5000, bounds=None):
+    #a point more than 2 standard deviations from the mean of the points around it is replaced by the average of its
+    #neighbours, the same rules as the 2 sigma version of clean_group but with every window worked out at once
+    values = np.asarray(prices, dtype=float)
+    local_means, local_stds = rolling_mean_std_excluding_centre(values, window_size, bounds)
+    if sigma_replace_kernel_compiled is not None and values.ndim == 1:
+        return sigma_replace_kernel_compiled(values, local_means, local_stds, float(sigmas), float(cap))
+    flagged = (values < local_means - sigmas * local_stds) | (values > local_means + sigmas * local_stds)
+    neighbours = neighbour_average(values)
+    cleaned = np.where(flagged, np.where(neighbours > cap, cap, neighbours), values)
+    #anything above the cap is set to the cap whether or not it was flagged
+    cleaned[values > cap] = cap
+    return cleaned
+
+#the prices on the EAFC transfer market go up in steps of 50 below 1000, 100 up to 10000, 250 up to 50000,
+#500 up to 100000 and 1000 above that
+PRICE_LADDER_BOUNDARIES = [0, 1000, 10000, 50000, 100000]
+PRICE_LADDER_TICKS = [50, 100, 250, 500, 1000]
+
+def snap_to_price_ladder(prices, boundaries=PRICE_LADDER_BOUNDARIES, ticks=PRICE_LADDER_TICKS):
+    #works out which band each price is in with one searchsorted and rounds it to the nearest step in that band,
+    #the same as 50 * round(x / 50) or 100 * round(x / 100) but for every price and every band at once
+    values = np.asarray(prices, dtype=float)
+    boundaries = np.asarray(boundaries, dtype=float)
+    ticks = np.asarray(ticks, dtype=float)
+    bands = np.clip(np.searchsorted(boundaries, values, side='right') - 1, 0, len(boundaries) - 1)
+    band_starts = boundaries[bands]
+    band_ticks = ticks[bands]
+    return band_starts + np.round((values - band_starts) / band_ticks) * band_ticks
+
+#each strategy takes an array of prices for one item and the window size and gives back the cleaned prices,
+#bounds can be given instead of the window size to use windows that are a length of time (see window_bounds_by_duration)
+CLEANING_STRATEGIES = {
+    "legacy": lambda prices, window_size, bounds=None: smooth_prices(prices, window_size, mode="legacy", bounds=bounds),
+    "centered": lambda prices, window_size, bounds=None: smooth_prices(prices, window_size, mode="centered", bounds=bounds),
+    "hampel": lambda prices, window_size, bounds=None: np.minimum(hampel_filter(prices, window_size, bounds=bounds), 5000),
+    "sigma": lambda prices, window_size, bounds=None: sigma_clip(prices, window_size, bounds=bounds),
+}
+
+#the strategies that only use whole window sums can clean every item at once down the columns of a 2d array
+WIDE_CLEANING_STRATEGIES = {
+    "centered": lambda prices, window_size: clean_prices_centered(prices, window_size),
+    "sigma": lambda prices, window_size: sigma_clip(prices, window_size),
+}
+
+def pivot_prices(df):
+    #puts the prices into one (times, items) array with nan where an item has no price in a snapshot
+    #a categorical item column already has its codes so they are used as they are
+    if isinstance(df['Item_name'].dtype, pd.CategoricalDtype):
+        item_codes, item_names = df['Item_name'].cat.codes.to_numpy(), df['Item_name'].cat.categories
+    else:
+        item_codes, item_names = pd.factorize(df['Item_name'], sort=True)
+    time_codes, times = pd.factorize(df['Date_time'], sort=True)
+    times = np.asarray(times)
+    matrix = np.full((len(times), len(item_names)), np.nan)
+    matrix[time_codes, item_codes] = df['Price'].to_numpy(dtype=float)
+    return times, list(item_names), matrix
+
+def unpivot_prices(times, item_names, matrix, present):
+    #turns the array back into rows, only for the places that had a price to begin with, ordered by item and then time
+    item_index, time_index = np.nonzero(present.T)
+    return pd.DataFrame({
+        'Item_name': pd.Categorical.from_codes(item_index, categories=item_names),
+        'Date_time': times[time_index],
+        'Price': matrix.T[present.T]})
+
+def forward_fill(matrix):
+    #fills each gap down a column with the last price above it, without a loop, by carrying forward the row number
+    #of the last price seen. Anything before an item's first price stays nan
+    rows = np.arange(len(matrix))[:, None]
+    last_seen = np.maximum.accumulate(np.where(~np.isnan(matrix), rows, 0), axis=0)
+    return np.take_along_axis(matrix, last_seen, axis=0)
+
+def resample_to_grid(df, freq_seconds=3600, how="mean", fill="ffill"):
+    #the scraper runs a few minutes past each hour (05:09:04 etc.) and sometimes misses an hour, so every price is put
+    #into its hour (or freq_seconds) bucket by whole number division of its time in seconds since 1970
+    if df.empty:
+        #with no prices there are no hours or items, so the grid is empty rather than an error
+        return {"times": np.array([], dtype='datetime64[ns]'), "items": [], "prices": np.empty((0, 0)), "observed": np.empty((0, 0), dtype=bool)}
+    item_codes, item_names = pd.factorize(df['Item_name'].astype(str), sort=True)
+    seconds = df['Date_time'].values.astype('datetime64[s]').astype(np.int64)
+    buckets = seconds // freq_seconds
+    first_bucket = buckets.min()
+    grid_rows = int(buckets.max() - first_bucket + 1)
+    cells = (buckets - first_bucket) * len(item_names) + item_codes
+    prices = df['Price'].to_numpy(dtype=float)
+    
+    #if an item has more than one price in a bucket they are averaged, or the latest one is kept
+    cell_counts = np.bincount(cells, minlength=grid_rows * len(item_names))
+    if how == "mean":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            flat = np.bincount(cells, weights=prices, minlength=grid_rows * len(item_names)) / cell_counts
+    elif how == "last":
+        order = np.argsort(seconds, kind="stable")
+        sorted_cells = cells[order][::-1]
+        unique_cells, first_in_reverse = np.unique(sorted_cells, return_index=True)
+        flat = np.full(grid_rows * len(item_names), np.nan)
+        flat[unique_cells] = prices[order][::-1][first_in_reverse]
+    else:
+        raise ValueError(f"Unknown aggregation {how}")
+    
+    matrix = flat.reshape(grid_rows, len(item_names))
+    observed = cell_counts.reshape(grid_rows, len(item_names)) > 0
+    #gaps are either filled with the last price or left as nan, observed says which prices were really scraped
+    if fill == "ffill":
+        matrix = forward_fill(matrix)
+    elif fill is not None:
+        raise ValueError(f"Unknown fill {fill}")
+    times = ((first_bucket + np.arange(grid_rows)) * freq_seconds).astype('datetime64[s]').astype('datetime64[ns]')
+    return {"times": times, "items": list(item_names), "prices": matrix, "observed": observed}
+
+def resampled_to_df(resampled):
+    #turns the grid back into rows, with a column saying whether each price was scraped or filled in
+    present = ~np.isnan(resampled["prices"])
+    df = unpivot_prices(resampled["times"], resampled["items"], resampled["prices"], present)
+    df["Filled"] = ~resampled["observed"].T[present.T]
+    return df
+
+def clean_all_data_wide(df, strategy="centered", window_size=10):
+    #the window is counted in snapshots, so a snapshot missing for an item makes that item's window one price smaller
+    #rather than reaching one price further, which is different to clean_all_data when there are gaps in the data
+    clean_prices = WIDE_CLEANING_STRATEGIES[strategy]
+    times, item_names, matrix = pivot_prices(df)
+    present = ~np.isnan(matrix)
+    cleaned_matrix = clean_prices(matrix, window_size)
+    return unpivot_prices(times, item_names, cleaned_matrix, present)
+
+def clean_all_data(df, strategy="legacy", window_size=10, snap_to_ladder=False, window_duration=None, min_window_points=5):
+    clean_prices = CLEANING_STRATEGIES[strategy]
     cleaned_data = []
     #iterate through the groups ordered by name
-    for name, group in df.groupby("Item_name"):
-        #takes the prices in the group and puts them into a list
-        group_prices = group["Price"].tolist()
-        cleaned_prices = clean_group(group_prices) 
+    for name, group in df.groupby("Item_name", observed=True):
+        bounds = None
+        if window_duration is not None:
+            #with a window that is a length of time (e.g. "10h") the group has to be in time order to find the windows
+            group = group.sort_values("Date_time", kind="stable")
+            bounds = window_bounds_by_duration(group["Date_time"].values, window_duration)
+            #windows with too few points around them (because of gaps in the scraping) are flagged
+            group["Sparse_window"] = (bounds[1] - bounds[0] - 1) < min_window_points
+        #takes the prices in the group and cleans them with the chosen strategy
+        cleaned_prices = clean_prices(group["Price"].to_numpy(), window_size, bounds)
         #overwrite the prices in the group with the cleaned ones
         group["Price"] = cleaned_prices
         #add the group data to the cleaned data
         cleaned_data.append(group)
     
     cleaned_dataframe = pd.concat(cleaned_data, ignore_index=True)
+    #snapped prices are real market prices so they can be stored as whole numbers instead of floats
+    if snap_to_ladder:
+        snapped_prices = snap_to_price_ladder(cleaned_dataframe["Price"])
+        if np.isnan(snapped_prices).any():
+            cleaned_dataframe["Price"] = pd.array(snapped_prices, dtype="Int32")
+        else:
+            cleaned_dataframe["Price"] = snapped_prices.astype(np.int32)
     return cleaned_dataframe
 
+def benchmark_cleaning(df, strategies=None, window_size=10, repeats=3):
+    #times each cleaning strategy on the dataframe and says which backend ran the loops. The best of the repeats is kept
+    #so the time numba takes to compile a kernel the first time it runs is not counted
+    print(f"Cleaning backend: {CLEANING_BACKEND}")
+    timings = {}
+    for strategy in strategies or list(CLEANING_STRATEGIES):
+        best_seconds = float("inf")
+        for _ in range(repeats):
+            strategy_start = time.perf_counter()
+            clean_all_data(df, strategy, window_size)
+            best_seconds = min(best_seconds, time.perf_counter() - strategy_start)
+        timings[strategy] = best_seconds
+        print(f"{strategy}: {best_seconds * 1000:.2f} ms")
+    return timings
+
+def sort_prices_by_item(df):
+    #the prices are sorted by item and then time into one array, so every item's prices sit next to each other
+    item_codes, item_names = pd.factorize(df['Item_name'].astype(str), sort=True)
+    times = df['Date_time'].values
+    order = np.lexsort((times, item_codes))
+    item_codes = item_codes[order]
+    values = df['Price'].to_numpy(dtype=float)[order]
+    item_starts = np.concatenate(([0], np.flatnonzero(np.diff(item_codes)) + 1)) if len(values) else np.array([], dtype=np.int64)
+    item_ends = np.concatenate((item_starts[1:], [len(values)])) if len(values) else np.array([], dtype=np.int64)
+    return item_codes, list(item_names), times[order], values, item_starts, item_ends
+
+def clean_price_chunk(task):
+    #this runs inside a worker process, it is sent a plain numpy array of prices and sends back the cleaned part of it
+    prices, strategy, window_size, keep_start, keep_end = task
+    return CLEANING_STRATEGIES[strategy](prices, window_size)[keep_start:keep_end]
+
+def clean_all_data_parallel(df, strategy="legacy", window_size=10, workers=None, chunk_size=None):
+    try:
+        item_codes, item_names, times, values, item_starts, item_ends = sort_prices_by_item(df)
+        
+        #each item is cleaned on its own. If chunk_size is given long items are also split into chunks of that many prices,
+        #each sent with an extra window of prices either side so the points at the edges of the chunk have full windows.
+        #the legacy smoothing depends on every price before it so it is always sent as a whole item
+        halo = window_size + 1
+        tasks = []
+        positions = []
+        for item_start, item_end in zip(item_starts.tolist(), item_ends.tolist()):
+            step = chunk_size if chunk_size and strategy != "legacy" else item_end - item_start
+            for chunk_start in range(item_start, item_end, step):
+                chunk_end = min(item_end, chunk_start + step)
+                send_start = max(item_start, chunk_start - halo)
+                send_end = min(item_end, chunk_end + halo)
+                tasks.append((values[send_start:send_end], strategy, window_size, chunk_start - send_start, chunk_end - send_start))
+                positions.append((chunk_start, chunk_end))
+        
+        cleaned_values = np.empty_like(values)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for (chunk_start, chunk_end), cleaned_chunk in zip(positions, executor.map(clean_price_chunk, tasks)):
+                cleaned_values[chunk_start:chunk_end] = cleaned_chunk
+        
+        return pd.DataFrame({
+            'Item_name': pd.Categorical.from_codes(item_codes, categories=item_names),
+            'Date_time': times,
+            'Price': cleaned_values})
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error cleaning data in parallel: {e}")
+        return None
+
+def cap_stage(values, cap=5000):
+    np.minimum(values, cap, out=values)
+
+def snap_stage(values, boundaries=PRICE_LADDER_BOUNDARIES, ticks=PRICE_LADDER_TICKS):
+    values[:] = snap_to_price_ladder(values, boundaries, ticks)
+
+def hampel_stage(values, window_size=10, threshold=3.0):
+    values[:] = hampel_filter(values, window_size, threshold)
+
+def sigma_stage(values, window_size=10, sigmas=2.0, cap=5000):
+    values[:] = sigma_clip(values, window_size, sigmas, cap)
+
+def smooth_stage(values, window_size=10, mode="legacy", cap=5000):
+    values[:] = smooth_prices(values, window_size, mode, cap)
+
+#each stage changes the prices it is given in place. The stages that only look at one price at a time are run over
+#every item in one go, the ones with windows are run over each item's prices on their own
+PIPELINE_STAGES = {
+    "cap": (cap_stage, False),
+    "snap": (snap_stage, False),
+    "hampel": (hampel_stage, True),
+    "sigma": (sigma_stage, True),
+    "smooth": (smooth_stage, True),
+}
+
+class CleaningPipeline:
+    #runs a list of cleaning stages in order, e.g. CleaningPipeline(["cap", "hampel", ("smooth", {"mode": "centered"}), "snap"])
+    def __init__(self, stages):
+        self.stages = []
+        for stage in stages:
+            name, options = (stage, {}) if isinstance(stage, str) else stage
+            if name not in PIPELINE_STAGES:
+                raise ValueError(f"Unknown cleaning stage {name}")
+            self.stages.append((name, options))
+        #how long each stage took the last time the pipeline was run, in seconds
+        self.timings = []
+    
+    def run(self, df):
+        #each stage can work on a slice of the sorted prices without copying, and there is no dataframe made between the stages
+        item_codes, item_names, times, values, item_starts, item_ends = sort_prices_by_item(df)
+        
+        self.timings = []
+        for name, options in self.stages:
+            stage, per_item = PIPELINE_STAGES[name]
+            stage_start = time.perf_counter()
+            if per_item:
+                for start, end in zip(item_starts.tolist(), item_ends.tolist()):
+                    stage(values[start:end], **options)
+            else:
+                stage(values, **options)
+            self.timings.append((name, time.perf_counter() - stage_start))
+        
+        return pd.DataFrame({
+            'Item_name': pd.Categorical.from_codes(item_codes, categories=item_names),
+            'Date_time': times,
+            'Price': values})
+    
+    def report_timings(self):
+        print(f"Cleaning backend: {CLEANING_BACKEND}")
+        for name, seconds in self.timings:
+            print(f"{name}: {seconds * 1000:.2f} ms")
+
+def item_names_query(table_name="Market_prices"):
+    #the item names are found by jumping through the (item, date) index one name at a time rather than reading every row,
+    #the names can then be used in a query that starts with this
+    return f"""WITH RECURSIVE all_names(Item_name) AS (
+                   SELECT MIN(Item_name) FROM {table_name}
+                   UNION ALL
+                   SELECT (SELECT MIN(Item_name) FROM {table_name} WHERE Item_name > all_names.Item_name) FROM all_names WHERE all_names.Item_name IS NOT NULL),
+               names(Item_name) AS (SELECT Item_name FROM all_names WHERE Item_name IS NOT NULL)"""
+
+def items_needing_cleaning(conn, table_name="Market_prices", cleaned_table="Cleaned_market_prices"):
+    items_query = f"{item_names_query(table_name)} SELECT Item_name FROM names"
+    items = []
+    for (item,) in conn.execute(items_query).fetchall():
+        #an item needs cleaning if it has raw prices newer than its latest cleaned price
+        raw_latest = conn.execute(f"SELECT MAX(Date_time) FROM {table_name} WHERE Item_name = ?", (item,)).fetchone()[0]
+        cleaned_latest = conn.execute(f"SELECT MAX(Date_time) FROM {cleaned_table} WHERE Item_name = ?", (item,)).fetchone()[0]
+        if cleaned_latest is None or raw_latest > cleaned_latest:
+            items.append((item, cleaned_latest))
+    return items
+
+def update_cleaned_tail(db_path, strategy="legacy", window_size=10, table_name="Market_prices", cleaned_table="Cleaned_market_prices"):
+    try:
+        clean_prices = CLEANING_STRATEGIES[strategy]
+        conn = connect_db(db_path)
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {cleaned_table} ("Item_name" TEXT, "Date_time" TIMESTAMP, "Price" REAL)')
+        with conn:
+            check_snapshot_times(conn, cleaned_table)
+            create_price_index(conn, table_name)
+            make_price_index_unique(conn, cleaned_table)
+        
+        #the items with new prices after their latest cleaned one, and the items whose older prices were changed
+        #by a late or changed file, which ingest_changed_files saves in Changed_prices
+        changes = read_changed_prices(conn, table_name)
+        items = dict(items_needing_cleaning(conn, table_name, cleaned_table))
+        for item in changes:
+            if item not in items:
+                items[item] = conn.execute(f"SELECT MAX(Date_time) FROM {cleaned_table} WHERE Item_name = ?", (item,)).fetchone()[0]
+        
+        rewrites = []
+        cleaned_changes = {}
+        for item, cleaned_latest in items.items():
+            #the first raw price that is different to when the item was last cleaned, None if it has never been cleaned
+            first_changed = None
+            if cleaned_latest is not None:
+                first_new = conn.execute(f"SELECT MIN(Date_time) FROM {table_name} WHERE Item_name = ? AND Date_time > ?", (item, cleaned_latest)).fetchone()[0]
+                first_changed = min(date_time for date_time in (first_new, changes.get(item)) if date_time is not None)
+            
+            if first_changed is None:
+                before = []
+                after = conn.execute(f"SELECT Date_time, Price FROM {table_name} WHERE Item_name = ? ORDER BY Date_time", (item,)).fetchall()
+            else:
+                #a changed price only changes the cleaned prices of the window_size points before it, and to work those out
+                #again they need window_size more points before them, so only that many raw prices are read back.
+                #every price from the first change onwards is read, as the change may be anywhere after it
+                before = conn.execute(f"SELECT Date_time, Price FROM {table_name} WHERE Item_name = ? AND Date_time < ? ORDER BY Date_time DESC LIMIT ?",
+                                      (item, first_changed, 2 * window_size)).fetchall()[::-1]
+                after = conn.execute(f"SELECT Date_time, Price FROM {table_name} WHERE Item_name = ? AND Date_time >= ? ORDER BY Date_time", (item, first_changed)).fetchall()
+            rows = before + after
+            date_times = [row[0] for row in rows]
+            prices = np.array([row[1] for row in rows], dtype=float)
+            
+            #the points before the ones that can have changed are only there as the left of the first windows
+            context_count = max(0, len(before) - window_size)
+            if strategy == "legacy" and context_count:
+                #the legacy smoothing uses the smoothed prices on the left so those are read from the cleaned table,
+                #if any of them are missing the table was changed some other way and the whole item is cleaned again
+                context_times = date_times[:context_count]
+                stored = dict(conn.execute(f"SELECT Date_time, Price FROM {cleaned_table} WHERE Item_name = ? AND Date_time BETWEEN ? AND ?",
+                                           (item, context_times[0], context_times[-1])).fetchall())
+                if all(date_time in stored for date_time in context_times):
+                    prices[:context_count] = [stored[date_time] if stored[date_time] is not None else np.nan for date_time in context_times]
+                else:
+                    rows = conn.execute(f"SELECT Date_time, Price FROM {table_name} WHERE Item_name = ? ORDER BY Date_time", (item,)).fetchall()
+                    date_times = [row[0] for row in rows]
+                    prices = np.array([row[1] for row in rows], dtype=float)
+                    first_changed, context_count = None, 0
+            if strategy == "legacy":
+                cleaned_prices = smooth_prices_legacy(prices, window_size, start_index=context_count)
+            else:
+                cleaned_prices = clean_prices(prices, window_size)
+            
+            #every cleaned price from rewrite_from onwards is written again, None means the whole item
+            if first_changed is None:
+                rewrite_from = None
+            elif context_count < len(date_times):
+                rewrite_from = min(first_changed, date_times[context_count])
+            else:
+                rewrite_from = first_changed
+            new_prices = dict(zip(date_times[context_count:], cleaned_prices[context_count:].tolist()))
+            if rewrite_from is None:
+                old_prices = dict(conn.execute(f"SELECT Date_time, Price FROM {cleaned_table} WHERE Item_name = ?", (item,)).fetchall())
+            else:
+                old_prices = dict(conn.execute(f"SELECT Date_time, Price FROM {cleaned_table} WHERE Item_name = ? AND Date_time >= ?", (item, rewrite_from)).fetchall())
+            #the earliest cleaned price that has really changed is saved so update_trend_stats can update its totals from there,
+            #a price worked out again with only rounding differences is not a change
+            for date_time in sorted(set(new_prices) | set(old_prices)):
+                if date_time not in old_prices or date_time not in new_prices:
+                    cleaned_changes[item] = date_time
+                    break
+                #a price with nothing in its window is stored as null
+                old_price = old_prices[date_time] if old_prices[date_time] is not None else np.nan
+                if not np.isclose(old_price, new_prices[date_time], rtol=1e-9, atol=0.0, equal_nan=True):
+                    cleaned_changes[item] = date_time
+                    break
+            rewrites.append((item, rewrite_from, list(new_prices.items())))
+        
+        #the cleaned prices from each item's first change are deleted and written again, so a price that was deleted from
+        #the raw table is deleted from the cleaned one too. The changes that were used are cleared in the same transaction
+        with conn:
+            for item, rewrite_from, new_rows in rewrites:
+                if rewrite_from is None:
+                    conn.execute(f"DELETE FROM {cleaned_table} WHERE Item_name = ?", (item,))
+                else:
+                    conn.execute(f"DELETE FROM {cleaned_table} WHERE Item_name = ? AND Date_time >= ?", (item, rewrite_from))
+                conn.executemany(f"INSERT INTO {cleaned_table} (Item_name, Date_time, Price) VALUES (?, ?, ?)",
+                                 [(item, date_time, price) for date_time, price in new_rows])
+            record_changed_prices(conn, cleaned_table, cleaned_changes)
+            clear_changed_prices(conn, table_name, changes)
+        conn.close()
+        return list(items)
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error updating cleaned prices: {e}")
+        return None
+
+class StreamingCleaner:
+    #cleans prices one at a time as they arrive, with the same rules as the legacy smoothing in clean_group
+    #a price can only be cleaned once the window_size prices after it have arrived, so each one comes out window_size prices late
+    def __init__(self, window_size=10, cap=5000):
+        self.window_size = window_size
+        self.cap = cap
+        #for each item: the last window_size cleaned prices (the left of the window) and the raw prices waiting to be cleaned
+        self.items = {}
+    
+    def item_state(self, item):
+        if item not in self.items:
+            self.items[item] = {"left": deque(maxlen=self.window_size), "pending": deque(), "last_time": None}
+        return self.items[item]
+    
+    def clean_next(self, item, state):
+        #cleans the oldest waiting price using the cleaned prices before it and the raw prices after it
+        date_time, price = state["pending"].popleft()
+        window = list(state["left"]) + [pending_price for pending_date_time, pending_price in state["pending"]]
+        local_mean = sum(window) / len(window) if window else float("nan")
+        cleaned_price = self.cap if local_mean > self.cap else local_mean
+        state["left"].append(cleaned_price)
+        return (item, date_time, cleaned_price)
+    
+    def add(self, item, date_time, price):
+        state = self.item_state(item)
+        date_time = pd.Timestamp(date_time)
+        #a snapshot that has already been seen for this item is ignored
+        if state["last_time"] is not None and date_time <= state["last_time"]:
+            return []
+        state["last_time"] = date_time
+        state["pending"].append((date_time, float(price)))
+        #once there are window_size prices after the oldest waiting one, its window is complete and it can be cleaned
+        if len(state["pending"]) > self.window_size:
+            return [self.clean_next(item, state)]
+        return []
+    
+    def flush(self):
+        #at the end of the stream the waiting prices are cleaned with the shorter windows they have, like the end of a series
+        cleaned = []
+        for item, state in self.items.items():
+            while state["pending"]:
+                cleaned.append(self.clean_next(item, state))
+        return cleaned
+    
+    def to_dict(self):
+        #everything is turned into plain lists and strings so it can be saved as json and the cleaner restarted later
+        return {"window_size": self.window_size,
+                "cap": self.cap,
+                "items": {item: {"left": list(state["left"]),
+                                 "pending": [[date_time.isoformat(), price] for date_time, price in state["pending"]],
+                                 "last_time": state["last_time"].isoformat() if state["last_time"] is not None else None}
+                          for item, state in self.items.items()}}
+    
+    @classmethod
+    def from_dict(cls, saved):
+        cleaner = cls(saved["window_size"], saved["cap"])
+        for item, saved_state in saved["items"].items():
+            state = cleaner.item_state(item)
+            state["left"].extend(saved_state["left"])
+            state["pending"].extend((pd.Timestamp(date_time), price) for date_time, price in saved_state["pending"])
+            state["last_time"] = pd.Timestamp(saved_state["last_time"]) if saved_state["last_time"] is not None else None
+        return cleaner
+    
+    def save(self, file_path):
+        with open(file_path, 'w') as file:
+            json.dump(self.to_dict(), file)
+    
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'r') as file:
+            return cls.from_dict(json.load(file))
+
+def watch_directory(directory_path, db_path, table_name="Market_prices", cleaned_table="Cleaned_market_prices", poll_seconds=5, settle_seconds=2, max_polls=None,
+                    trend_stats_table=None, half_life_days=None, window_days=None, manifest_table="Processed_files"):
+    #polling is used rather than inotify so the watcher works the same on windows and linux
+    last_seen = {}
+    done = {}
+    latencies = []
+    polls = 0
+    try:
+        #the files that were ingested before the watcher started are taken from the manifest, so that after a restart
+        #the whole archive is not treated as new files
+        conn = sqlite3.connect(db_path)
+        if table_exists(conn, manifest_table):
+            for file_name, size, mtime in conn.execute(f"SELECT File_name, Size, Mtime FROM {manifest_table}"):
+                done[file_name] = (size, mtime)
+        conn.close()
+        
+        while max_polls is None or polls < max_polls:
+            polls += 1
+            now = time.time()
+            ready = []
+            for file_name in list_csv_files(directory_path):
+                #a file can be moved or deleted between listing the directory and looking at it, it is just skipped
+                try:
+                    file_stats = os.stat(os.path.join(directory_path, file_name))
+                except FileNotFoundError:
+                    last_seen.pop(file_name, None)
+                    continue
+                file_key = (file_stats.st_size, file_stats.st_mtime)
+                previous_key = last_seen.get(file_name)
+                last_seen[file_name] = file_key
+                if done.get(file_name) == file_key:
+                    continue
+                #a file is only read once its size and modified time have stopped changing and it has been left alone
+                #for settle_seconds, so files that the scraper is still writing are not read half finished
+                if previous_key == file_key and now - file_stats.st_mtime >= settle_seconds:
+                    ready.append((file_name, file_key))
+            
+            if ready:
+                ingested = ingest_changed_files(directory_path, db_path, table_name, manifest_table, file_names=[file_name for file_name, file_key in ready])
+                ingested_files = ingested[0] if ingested is not None else None
+                if ingested_files is not None:
+                    ingested_time = time.time()
+                    for file_name, file_key in ready:
+                        done[file_name] = file_key
+                #files whose contents had not changed are skipped by the manifest, so only the files that were really read
+                #are timed and passed on
+                ready = [(file_name, file_key) for file_name, file_key in ready if ingested_files and file_name in ingested_files]
+                if ready:
+                    cleaned_items = update_cleaned_tail(db_path, table_name=table_name, cleaned_table=cleaned_table)
+                    cleaned_time = time.time()
+                    for file_name, file_key in ready:
+                        #latency is measured from when the file was last written to when its rows could be queried
+                        latency = (file_name, ingested_time - file_key[1], cleaned_time - file_key[1])
+                        latencies.append(latency)
+                        print(f"{file_name}: raw rows queryable after {latency[1]:.2f}s, cleaned after {latency[2]:.2f}s")
+                    if cleaned_items:
+                        print(f"Re-cleaned {len(cleaned_items)} items")
+                    #the newly cleaned prices are also added to the running trend totals so the forecast is ready straight away
+                    if trend_stats_table is not None:
+                        trend_items = update_trend_stats(db_path, trend_stats_table, cleaned_table, half_life_days, window_days)
+                        if trend_items:
+                            print(f"Updated the trend of {trend_items} items")
+                    report_latencies(latencies)
+            
+            if max_polls is None or polls < max_polls:
+                time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        print("Stopped watching directory")
+    return latencies
+
+def report_latencies(latencies):
+    #prints a summary of how long files took to reach the database
+    raw_latencies = np.array([latency[1] for latency in latencies])
+    cleaned_latencies = np.array([latency[2] for latency in latencies])
+    print(f"Files ingested: {len(latencies)}, raw latency median {np.median(raw_latencies):.2f}s max {raw_latencies.max():.2f}s, "
+          f"cleaned latency median {np.median(cleaned_latencies):.2f}s max {cleaned_latencies.max():.2f}s")
+
+NANOSECONDS_PER_HOUR = 60 * 60 * 10**9
+NANOSECONDS_PER_DAY = 24 * NANOSECONDS_PER_HOUR
+
+def time_features(date_times, earliest_date=None):
+    #works out the days since the earliest date, the hour of the day and the day of the week (monday is 0) for every
+    #date at once from the dates as whole numbers of nanoseconds since 1970, rather than going through them one at a time
+    nanoseconds = np.asarray(date_times, dtype='datetime64[ns]').view('int64')
+    if earliest_date is None:
+        earliest_date = nanoseconds.min()
+    else:
+        earliest_date = np.datetime64(earliest_date, 'ns').view('int64')
+    whole_days = nanoseconds // NANOSECONDS_PER_DAY
+    return {
+        'Days_since_start': (nanoseconds - earliest_date) / NANOSECONDS_PER_DAY,
+        'Hour': (nanoseconds // NANOSECONDS_PER_HOUR) % 24,
+        #1970-01-01 was a thursday, which is day 3
+        'Weekday': (whole_days + 3) % 7}
+
 def forecast_prices(cleaned_df, days_to_forecast):
-    #create a list of the dates in the dataframe
-    dates = cleaned_df['Date_time'].tolist()
-    
-    #work out the earliest and latest dates by sorting the dates in the df
-    sorted_dates = cleaned_df['Date_time'].sort_values()
-    sorted_dates_list = sorted_dates.tolist()
-    earliest_date = sorted_dates_list[0]
-    latest_date = sorted_dates_list[-1]
-    
-    days_time_difference = []
-    for date in dates:
-        #work out the total seconds between the first date and the current date
-        difference_seconds = (date - earliest_date).total_seconds()
-        #convert seconds into days for the days difference
-        difference_days = difference_seconds / (24 * 60 * 60)  
-        days_time_difference.append(difference_days)    
-    
-    #reshape the time differences to be in an array and between -1 and 1
-    x = np.array(days_time_difference)
-    X = x.reshape(-1, 1)
+    #the earliest and latest dates are found with min and max rather than sorting the whole column
+    dates = cleaned_df['Date_time'].values
+    earliest_date = dates.min()
+    latest_date = dates.max()
+    
+    #the days between the first date and every date, as an array with one column for the model
+    X = time_features(dates, earliest_date)['Days_since_start'].reshape(-1, 1)
     #reshape the cleaned_df prices into an array
     Y = np.array(cleaned_df["Price"])
     
@@ -161,17 +1546,7 @@ def forecast_prices(cleaned_df, days_to_forecast):
     future_dates = future_dates_including_latest[1:]
     
     #same logic as earlier applied to the future days
-    future_time_difference = []
-    for date in future_dates:
-        #work out the total seconds between the first date and the current future date
-        difference_seconds = (date - earliest_date).total_seconds()
-        #convert seconds into days for the days difference
-        difference_days = difference_seconds / (24 * 60 * 60)
-        future_time_difference.append(difference_days)
-    
-    #reshape the future days into an array and between values 1 and -1
-    x_future = np.array(future_time_difference)
-    X_future = x_future.reshape(-1, 1)
+    X_future = time_features(future_dates, earliest_date)['Days_since_start'].reshape(-1, 1)
     
     #use the model to predict price values for these days
     future_prices = model.predict(X_future)
@@ -179,6 +1554,251 @@ def forecast_prices(cleaned_df, days_to_forecast):
     forecast_df = pd.DataFrame({'Date_time': future_dates, 'Price': future_prices})
     return forecast_df
 
+def trend_coefficients(counts, sum_x, sum_y, sum_xy, sum_xx):
+    #the least squares slope and intercept worked out straight from the totals of x, y, xy and x squared,
+    #for every item at once. This gives the same line as LinearRegression with one feature
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = sum_x / counts
+        mean_y = sum_y / counts
+        spread_x = sum_xx - sum_x * mean_x
+        slopes = (sum_xy - sum_x * mean_y) / spread_x
+    #an item with one price, or with every price at the same time, gets a flat line through its mean like LinearRegression
+    #gives, the small tolerance stops rounding in the totals being taken as a real spread of times
+    slopes = np.where(spread_x > 1e-9 * sum_xx, slopes, 0.0)
+    intercepts = mean_y - slopes * mean_x
+    return slopes, intercepts
+
+def fit_trends(cleaned_df):
+    #fits a straight line to the prices of every item at once. The totals for each item are added up with bincount
+    #rather than making a LinearRegression for each item, and the line is kept so it can be used for any number of days
+    prices = cleaned_df['Price'].to_numpy(dtype=float)
+    present = ~np.isnan(prices)
+    item_codes, item_names = pd.factorize(cleaned_df['Item_name'].astype(str)[present], sort=True)
+    nanoseconds = np.asarray(cleaned_df['Date_time'].values[present], dtype='datetime64[ns]').view('int64')
+    prices = prices[present]
+    number_of_items = len(item_names)
+    
+    #each item's times are counted in days from its own first date, which keeps the totals small
+    start_dates = np.full(number_of_items, np.iinfo(np.int64).max)
+    latest_dates = np.full(number_of_items, np.iinfo(np.int64).min)
+    np.minimum.at(start_dates, item_codes, nanoseconds)
+    np.maximum.at(latest_dates, item_codes, nanoseconds)
+    x = (nanoseconds - start_dates[item_codes]) / NANOSECONDS_PER_DAY
+    
+    counts = np.bincount(item_codes, minlength=number_of_items).astype(float)
+    sum_x = np.bincount(item_codes, weights=x, minlength=number_of_items)
+    sum_y = np.bincount(item_codes, weights=prices, minlength=number_of_items)
+    sum_xy = np.bincount(item_codes, weights=x * prices, minlength=number_of_items)
+    sum_xx = np.bincount(item_codes, weights=x * x, minlength=number_of_items)
+    slopes, intercepts = trend_coefficients(counts, sum_x, sum_y, sum_xy, sum_xx)
+    
+    #the slope is the change in price per day and the intercept is the price on the start date
+    return pd.DataFrame({
+        'Item_name': list(item_names),
+        'Start_date': start_dates.view('datetime64[ns]'),
+        'Latest_date': latest_dates.view('datetime64[ns]'),
+        'Points': counts.astype(np.int64),
+        'Slope': slopes,
+        'Intercept': intercepts})
+
+def predict_trends(trends, days_to_forecast):
+    #uses the fitted lines to forecast every item for the days after its latest date, without fitting them again.
+    #the days are the same as forecast_prices gives, one a day for days_to_forecast - 1 days
+    day_offsets = np.arange(1, days_to_forecast, dtype=np.int64) * NANOSECONDS_PER_DAY
+    latest_dates = np.asarray(trends['Latest_date'].values, dtype='datetime64[ns]').view('int64')
+    start_dates = np.asarray(trends['Start_date'].values, dtype='datetime64[ns]').view('int64')
+    future_dates = latest_dates[:, None] + day_offsets[None, :]
+    x = (future_dates - start_dates[:, None]) / NANOSECONDS_PER_DAY
+    future_prices = trends['Intercept'].to_numpy()[:, None] + trends['Slope'].to_numpy()[:, None] * x
+    return pd.DataFrame({
+        'Item_name': np.repeat(trends['Item_name'].to_numpy(), len(day_offsets)),
+        'Date_time': future_dates.ravel().view('datetime64[ns]'),
+        'Price': future_prices.ravel()})
+
+def create_trend_stats_table(conn, stats_table="Trend_stats"):
+    #one row for each item with the running totals its trend line is worked out from, x is the days since Start_date.
+    #Count is how many prices are in the totals and Weight is what they add up to once they have been decayed.
+    #the table the prices came from and the settings are kept with the totals so they cannot be mixed with other totals
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {stats_table} ("Item_name" TEXT PRIMARY KEY, "Start_date" TEXT, "Latest_date" TEXT, '
+                 f'"Count" INTEGER, "Weight" REAL, "Sum_x" REAL, "Sum_y" REAL, "Sum_xy" REAL, "Sum_xx" REAL, '
+                 f'"Source_table" TEXT, "Half_life_days" REAL, "Window_days" REAL)')
+    #every price in the totals is also kept exactly as it was added, so it can be taken off again when it leaves the window
+    #or is cleaned again, even though the source table may have been changed since
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {stats_table}_points ("Item_name" TEXT, "Date_time" TEXT, "Price" REAL, PRIMARY KEY ("Item_name", "Date_time"))')
+    if "Source_table" not in [column[1] for column in conn.execute(f"PRAGMA table_info({stats_table})")]:
+        raise ValueError(f"{stats_table} was made before its settings were stored, drop it so it can be built again")
+
+def add_to_trend_totals(totals, x, price, weight):
+    #adds a price to the totals [count, weight, sum x, sum y, sum xy, sum xx], a negative weight takes it off again
+    totals[0] += 1 if weight > 0 else -1
+    totals[1] += weight
+    totals[2] += weight * x
+    totals[3] += weight * price
+    totals[4] += weight * x * price
+    totals[5] += weight * x * x
+
+def update_trend_stats(db_path, stats_table="Trend_stats", source_table="Cleaned_market_prices", half_life_days=None, window_days=None, revise_points=10):
+    #keeps the running totals of every item up to date with the cleaned prices, which are the prices forecast_prices fits,
+    #so the trend does not have to be refitted over the whole history. The prices are read from source_table, each one after
+    #an item's latest date is added in O(1). Cleaning a new price also changes the cleaned prices just before it
+    #(update_cleaned_tail cleans window_size of them again), so the last revise_points prices in the totals are checked
+    #and any that have changed are taken off and added again with their new value. A late or changed file can change older
+    #cleaned prices too, update_cleaned_tail saves the earliest one in Changed_prices and the totals are updated from there,
+    #or worked out again from the start if the prices they were made with are no longer all kept.
+    #with half_life_days the older prices count for less, halving every half_life_days, and with window_days only the prices
+    #in the last window_days are kept. The totals can only be updated with the source table and settings they were made with
+    try:
+        points_table = f"{stats_table}_points"
+        conn = connect_db(db_path)
+        with conn:
+            create_trend_stats_table(conn, stats_table)
+        settings = (source_table, float(half_life_days) if half_life_days is not None else None, float(window_days) if window_days is not None else None)
+        for saved_settings in conn.execute(f"SELECT DISTINCT Source_table, Half_life_days, Window_days FROM {stats_table}"):
+            if tuple(saved_settings) != settings:
+                raise ValueError(f"{stats_table} was made from {saved_settings[0]} with half_life_days={saved_settings[1]} and window_days={saved_settings[2]}, "
+                                 f"not from {source_table} with half_life_days={half_life_days} and window_days={window_days}")
+        
+        one_day = pd.Timedelta(days=1)
+        window = pd.Timedelta(days=window_days) if window_days is not None else None
+        def decay_weight(date_time, latest):
+            #how much a price counts for once the totals have been decayed up to latest
+            return 0.5 ** ((latest - date_time) / one_day / half_life_days) if half_life_days is not None else 1.0
+        
+        updated_items = 0
+        changes = read_changed_prices(conn, source_table)
+        items = [row[0] for row in conn.execute(f"{item_names_query(source_table)} SELECT Item_name FROM names")]
+        items = sorted(set(items) | set(changes))
+        #every change is made in one transaction so the totals and the prices kept with them always match
+        with conn:
+            for item in items:
+                saved = conn.execute(f"SELECT Start_date, Latest_date, Count, Weight, Sum_x, Sum_y, Sum_xy, Sum_xx FROM {stats_table} WHERE Item_name = ?", (item,)).fetchone()
+                if saved is not None and item in changes:
+                    #a price that changed before the first one kept cannot be taken off, so the item's totals are made again
+                    first_kept = conn.execute(f"SELECT MIN(Date_time) FROM {points_table} WHERE Item_name = ?", (item,)).fetchone()[0]
+                    if first_kept is None or changes[item] < first_kept:
+                        conn.execute(f"DELETE FROM {stats_table} WHERE Item_name = ?", (item,))
+                        conn.execute(f"DELETE FROM {points_table} WHERE Item_name = ?", (item,))
+                        saved = None
+                if saved is None:
+                    start, latest, totals, since = None, None, [0, 0.0, 0.0, 0.0, 0.0, 0.0], None
+                else:
+                    start, latest, totals = pd.Timestamp(saved[0]), pd.Timestamp(saved[1]), list(saved[2:])
+                    #the prices are read again from the revise_points-th last one that was added
+                    revise_from = conn.execute(f"SELECT Date_time FROM {points_table} WHERE Item_name = ? ORDER BY Date_time DESC LIMIT 1 OFFSET ?",
+                                               (item, revise_points - 1)).fetchone()
+                    since = revise_from[0] if revise_from is not None else saved[0]
+                    if item in changes:
+                        since = min(since, changes[item])
+                if since is None:
+                    rows = conn.execute(f"SELECT Date_time, Price FROM {source_table} WHERE Item_name = ? ORDER BY Date_time", (item,)).fetchall()
+                    added = {}
+                else:
+                    rows = conn.execute(f"SELECT Date_time, Price FROM {source_table} WHERE Item_name = ? AND Date_time >= ? ORDER BY Date_time", (item, since)).fetchall()
+                    added = dict(conn.execute(f"SELECT Date_time, Price FROM {points_table} WHERE Item_name = ? AND Date_time >= ?", (item, since)).fetchall())
+                
+                changed = False
+                #a price in the totals that has since been deleted, or cleaned to nothing, is taken off
+                present = {date_time_text for date_time_text, price in rows if price is not None}
+                for date_time_text, old_price in list(added.items()):
+                    if date_time_text not in present:
+                        old_date_time = pd.Timestamp(date_time_text)
+                        add_to_trend_totals(totals, (old_date_time - start) / one_day, old_price, -decay_weight(old_date_time, latest))
+                        del added[date_time_text]
+                        conn.execute(f"DELETE FROM {points_table} WHERE Item_name = ? AND Date_time = ?", (item, date_time_text))
+                        changed = True
+                for date_time_text, price in rows:
+                    #a cleaned price with nothing in its window is stored as null and is left out
+                    if price is None:
+                        continue
+                    date_time = pd.Timestamp(date_time_text)
+                    if date_time_text in added:
+                        #a price that is already in the totals but has been cleaned again is swapped for its new value
+                        if added[date_time_text] != price:
+                            x = (date_time - start) / one_day
+                            add_to_trend_totals(totals, x, added[date_time_text], -decay_weight(date_time, latest))
+                            add_to_trend_totals(totals, x, price, decay_weight(date_time, latest))
+                            added[date_time_text] = price
+                            conn.execute(f"UPDATE {points_table} SET Price = ? WHERE Item_name = ? AND Date_time = ?", (price, item, date_time_text))
+                            changed = True
+                        continue
+                    if latest is not None and date_time <= latest:
+                        #a price older than the totals that is not in them came from a late file, it is added with the weight
+                        #it would have now unless it has already left the window
+                        if window is None or date_time > latest - window:
+                            add_to_trend_totals(totals, (date_time - start) / one_day, price, decay_weight(date_time, latest))
+                            added[date_time_text] = price
+                            conn.execute(f"INSERT OR REPLACE INTO {points_table} (Item_name, Date_time, Price) VALUES (?, ?, ?)", (item, date_time_text, price))
+                            changed = True
+                        continue
+                    
+                    if half_life_days is not None and latest is not None:
+                        #every price so far is made older by the time since the last one, which is one multiplication of each total
+                        decay = 0.5 ** ((date_time - latest) / one_day / half_life_days)
+                        totals[1:] = [total * decay for total in totals[1:]]
+                    if window is not None and latest is not None:
+                        #the prices that are too old for the window now are taken off the totals with the values they were added with
+                        cutoff = (date_time - window).strftime("%Y-%m-%d %H:%M:%S")
+                        for old_date_time_text, old_price in conn.execute(f"SELECT Date_time, Price FROM {points_table} WHERE Item_name = ? AND Date_time <= ?", (item, cutoff)).fetchall():
+                            old_date_time = pd.Timestamp(old_date_time_text)
+                            add_to_trend_totals(totals, (old_date_time - start) / one_day, old_price, -decay_weight(old_date_time, date_time))
+                            added.pop(old_date_time_text, None)
+                        conn.execute(f"DELETE FROM {points_table} WHERE Item_name = ? AND Date_time <= ?", (item, cutoff))
+                        #if every price has left the window the totals start again from this price, so no rounding is carried over
+                        if totals[0] <= 0:
+                            start, totals = None, [0, 0.0, 0.0, 0.0, 0.0, 0.0]
+                    
+                    if start is None:
+                        start = date_time
+                    add_to_trend_totals(totals, (date_time - start) / one_day, price, 1.0)
+                    added[date_time_text] = price
+                    conn.execute(f"INSERT OR REPLACE INTO {points_table} (Item_name, Date_time, Price) VALUES (?, ?, ?)", (item, date_time_text, price))
+                    latest = date_time
+                    changed = True
+                
+                if window is None:
+                    #without a window only the prices that can still be cleaned again need to be kept
+                    conn.execute(f"DELETE FROM {points_table} WHERE Item_name = ? AND Date_time < (SELECT Date_time FROM {points_table} WHERE Item_name = ? "
+                                 f"ORDER BY Date_time DESC LIMIT 1 OFFSET ?)", (item, item, revise_points - 1))
+                if changed:
+                    conn.execute(f"INSERT OR REPLACE INTO {stats_table} (Item_name, Start_date, Latest_date, Count, Weight, Sum_x, Sum_y, Sum_xy, Sum_xx, "
+                                 f"Source_table, Half_life_days, Window_days) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (item, start.strftime("%Y-%m-%d %H:%M:%S"), latest.strftime("%Y-%m-%d %H:%M:%S"), *totals, *settings))
+                    updated_items += 1
+            clear_changed_prices(conn, source_table, changes)
+        conn.close()
+        return updated_items
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error updating trend stats: {e}")
+        return None
+
+def read_trend_stats(db_path, stats_table="Trend_stats", items=None):
+    #works out the current trend line of each item from its saved totals, in the same table as fit_trends gives
+    try:
+        conn = sqlite3.connect(db_path)
+        stats = pd.read_sql_query(f"SELECT * FROM {stats_table} ORDER BY Item_name", conn)
+        conn.close()
+        if items is not None:
+            stats = stats[stats['Item_name'].isin(list(items))]
+        slopes, intercepts = trend_coefficients(stats['Weight'].to_numpy(), stats['Sum_x'].to_numpy(), stats['Sum_y'].to_numpy(),
+                                                stats['Sum_xy'].to_numpy(), stats['Sum_xx'].to_numpy())
+        return pd.DataFrame({
+            'Item_name': stats['Item_name'].to_numpy(),
+            'Start_date': pd.to_datetime(stats['Start_date']).to_numpy(dtype='datetime64[ns]'),
+            'Latest_date': pd.to_datetime(stats['Latest_date']).to_numpy(dtype='datetime64[ns]'),
+            'Points': stats['Count'].to_numpy(dtype=np.int64),
+            'Slope': slopes,
+            'Intercept': intercepts})
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error reading trend stats: {e}")
+        return None
+
+def forecast_from_trend_stats(db_path, days_to_forecast, items=None, stats_table="Trend_stats"):
+    #the forecast comes straight from the saved totals, so nothing has to be refitted when it is asked for
+    trends = read_trend_stats(db_path, stats_table, items)
+    if trends is None:
+        return None
+    return predict_trends(trends, days_to_forecast)
+
 if __name__ == "__main__":
     #set the base path into the directory that holds both the data folder and the coding folder
     base_path = r'C:\Users\paddy\OneDrive - Lancing College\NEA'
@@ -190,21 +1810,43 @@ if __name__ == "__main__":
 
     #select the read from directory to update the database, select read database for a quick run
     #df = read_directory_to_df(directory_path)
-    df = read_db_to_df(db_path, table_name)
+    #df = read_db_to_df(db_path, table_name)
+    #ingest new files only adds the files that have arrived or changed since it was last run
+    #ingest_new_files(directory_path, db_path, table_name)
+    #for a full rebuild of the database the files can be read across all of the cpu cores
+    #df = read_directory_parallel(directory_path)
+    #to rebuild the table without holding every file in memory the rows can be streamed straight into the database
+    #write_batches_to_db(iter_price_batches(directory_path), db_path, table_name)
+    #to keep the database up to date as the scraper saves new files the directory can be watched instead
+    #watch_directory(directory_path, db_path, table_name)
+    #the trend of every item can also be kept up to date as the files arrive, here over the last 30 days of cleaned prices
+    #watch_directory(directory_path, db_path, table_name, trend_stats_table="Trend_stats", window_days=30)
+    #a database made by the old reader has to be moved to one time per snapshot once, before any new files are ingested into it
+    #migrate_to_snapshot_times(directory_path, db_path, table_name)
+    #the compact database stores ids and whole second times, it only needs migrating once from the old database
+    #migrate_to_compact_db(db_path, os.path.join(base_path, 'Code', 'Output Files', 'Market_prices_compact.db'))
+    #df = read_compact_db_to_df(os.path.join(base_path, 'Code', 'Output Files', 'Market_prices_compact.db'))
         
     #limit the data in the dataframe so that it only shows so much data and for only one item
     start_date = '2024-01-01 00:00:00'
     end_date = '2024-03-25 00:00:00'
     selected_item = 'Anchor'
+    #the forecast can be read straight from the trend totals kept by watch_directory
+    #forecast_df = forecast_from_trend_stats(db_path, 14, items=[selected_item])
+    
+    #when only a few weeks are needed, only the files for those hours are read from the directory
+    #df = read_directory_to_df(directory_path, start=start_date, end=end_date, items=[selected_item])
     
-    filtered_original_df = df[df['Item_name'] == selected_item]
-    filtered_original_df = filtered_original_df[(filtered_original_df['Date_time'] >= '2024-01-01 00:00:00') & (filtered_original_df['Date_time'] <= '2024-04-01 00:00:00')]
-    filtered_original_df_with_limited_dates = df[(df['Date_time'] >= start_date) & (df['Date_time'] <= end_date)]
+    #the item and dates are filtered in the database so only the rows needed are read
+    filtered_original_df = query_prices(db_path, items=[selected_item], start='2024-01-01 00:00:00', end='2024-04-01 00:00:00', table_name=table_name)
+    filtered_original_df_with_limited_dates = query_prices(db_path, start=start_date, end=end_date, table_name=table_name)
     #filtered_original_df = df
     
     #checks if the dataframe is empty
     if filtered_original_df is not None:
         print("Directory data loaded:", filtered_original_df.head())
+        #times every cleaning strategy and prints whether the numba or numpy kernels were used
+        #benchmark_cleaning(filtered_original_df)
         plt.figure(figsize=(10, 6))
         #plot the original data in blue
         plt.plot(filtered_original_df['Date_time'], filtered_original_df['Price'], label='Original', color='blue')
@@ -212,7 +1854,13 @@ if __name__ == "__main__":
         #clean the dataframe and then use this cleaned dataframe to forecast
         cleaned_df = clean_all_data(filtered_original_df.copy())
         cleaned_filtered_original_df = clean_all_data(filtered_original_df_with_limited_dates) 
+        #the items can be cleaned across several processes instead, which gives the same result
+        #cleaned_filtered_original_df = clean_all_data_parallel(filtered_original_df_with_limited_dates)
         forecast_df = forecast_prices(cleaned_filtered_original_df, 14)
+        #the trend of every item can be fitted at once instead, and then forecast for any number of days without refitting
+        #trends = fit_trends(cleaned_filtered_original_df)
+        #forecast_df = predict_trends(trends, 14)
+        #forecast_df = forecast_df[forecast_df['Item_name'] == selected_item]
         
         #checks if the cleaned and forecast is empty
         if cleaned_df is not None:
@@ -231,10 +1879,10 @@ if __name__ == "__main__":
         plt.tight_layout()
         plt.show()
         
-        #write the data from the dataframe just created into the database
-        #if write_df_to_db(df, db_path, "Market_prices"):
+        #write the data from the dataframe just created into the database, only the rows that are new or changed are written
+        #if upsert_df_to_db(df, db_path, "Market_prices"):
          #   print(f"DataFrame written to {db_path}, table Market_prices")
-        #if write_df_to_db(cleaned_df, db_path, "Cleaned_market_prices"):
+        #if upsert_df_to_db(cleaned_df, db_path, "Cleaned_market_prices"):
          #   print(f"DataFrame written to {db_path}, table Cleaned_market_prices")
 
         #reads the data just put into the database back into another dataframe and then prints it so that I can check the data has not been changed
@@ -22,13 +22,74 @@ def Read_db_to_df(db_path, table_name):
     except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
         print(f"Error reading database: {e}")
         return None
+
+# Function to make the (item, date) index, the same statement as create_price_index in the backend
+def Create_price_index(conn, table_name):
+    #this never changes the rows, if the backend has already made the index unique this does nothing
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_item_time ON {table_name} (Item_name, Date_time)")
+
+# Function to read only the items, dates and columns needed from the database
+def Query_prices(db_path, table_name, items=None, start=None, end=None, columns=None):
+    try:
+        #only known column names are put into the query, everything else is passed in as a parameter
+        allowed_columns = ['Item_name', 'Date_time', 'Price']
+        if columns is None:
+            columns = allowed_columns
+        for column in columns:
+            if column not in allowed_columns:
+                raise ValueError(f"Unknown column {column}")
+        
+        conditions = []
+        params = []
+        if items is not None:
+            items = list(items)
+            if not items:
+                return pd.DataFrame(columns=columns)
+            conditions.append(f"Item_name IN ({', '.join('?' * len(items))})")
+            params.extend(items)
+        if start is not None:
+            conditions.append("Date_time >= ?")
+            params.append(pd.to_datetime(start).strftime("%Y-%m-%d %H:%M:%S"))
+        if end is not None:
+            conditions.append("Date_time <= ?")
+            params.append(pd.to_datetime(end).strftime("%Y-%m-%d %H:%M:%S"))
+        
+        query = f"SELECT {', '.join(columns)} FROM {table_name}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY Item_name, Date_time"
+        
+        conn = sqlite3.connect(db_path)
+        #the (item, date) index means sqlite only reads the rows for the selected items and dates
+        Create_price_index(conn, table_name)
+        df = pd.read_sql_query(query, conn, params=params)
+        conn.close()
+        
+        if 'Date_time' in df.columns:
+            df['Date_time'] = pd.to_datetime(df['Date_time'], format="ISO8601")
+        return df
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error querying database: {e}")
+        return None
+
+# Function to get the item names and the first and last dates without reading all of the prices
+def Read_items_and_dates(db_path, table_name):
+    try:
+        conn = sqlite3.connect(db_path)
+        Create_price_index(conn, table_name)
+        items = [row[0] for row in conn.execute(f"SELECT DISTINCT Item_name FROM {table_name}")]
+        earliest_date, latest_date = conn.execute(f"SELECT MIN(Date_time), MAX(Date_time) FROM {table_name}").fetchone()
+        conn.close()
+        return items, pd.to_datetime(earliest_date), pd.to_datetime(latest_date)
+    except Exception as e: #if this function throws an error it is caught and tells the user there was an error in this function and what the error was
+        print(f"Error reading items and dates: {e}")
+        return None
     
     
 def Show_forecaster_page():
-        #access the cleaned data out of the database and ensure that its type is datetime
+        #get the list of items out of the database, the prices are only read for the item that is selected
         db_path = os.path.join(base_path, 'Output Files', 'Market_prices_cleaned_all.db')
-        cleaned_df = Read_db_to_df(db_path, "Cleaned_market_prices")
-        cleaned_df['Date_time'] = pd.to_datetime(cleaned_df['Date_time'])
+        available_items, earliest_date, latest_date = Read_items_and_dates(db_path, "Cleaned_market_prices")
         
         #set the title of the page and the sidebar header
         st.set_page_config(page_title="Price Data Visualizer", layout="wide") #sets up the page
@@ -37,9 +98,8 @@ def Show_forecaster_page():
         st.sidebar.header("Select which item to forecast:")
         
         #like the graphing page get the list of available items and then using the selectbox allow the user to choose one item from the available items
-        available_items = cleaned_df["Item_name"].unique().tolist()
         item_selected = st.sidebar.selectbox("Select Item to Forecast", options = available_items, index = 0)
-        filtered_df = cleaned_df[cleaned_df["Item_name"] == item_selected]
+        filtered_df = Query_prices(db_path, "Cleaned_market_prices", items = [item_selected])
         
         #create a slider to determine how long the forecast should be with default value 7 days and min and max values 1 and 30
         days_to_forecast = st.sidebar.slider("Number of Days to Forecast:", min_value = 3, max_value = 30, value = 7)
@@ -65,27 +125,32 @@ def Show_forecaster_page():
         forecast_graph.update_layout(xaxis_title="Date", yaxis_title="Price", legend_title="Items Graphed", hovermode="x unified")
         st.plotly_chart(forecast_graph)
     
+NANOSECONDS_PER_HOUR = 60 * 60 * 10**9
+NANOSECONDS_PER_DAY = 24 * NANOSECONDS_PER_HOUR
+
+def time_features(date_times, earliest_date=None):
+    #works out the days since the earliest date, the hour of the day and the day of the week (monday is 0) for every
+    #date at once from the dates as whole numbers of nanoseconds since 1970, rather than going through them one at a time
+    nanoseconds = np.asarray(date_times, dtype='datetime64[ns]').view('int64')
+    if earliest_date is None:
+        earliest_date = nanoseconds.min()
+    else:
+        earliest_date = np.datetime64(earliest_date, 'ns').view('int64')
+    whole_days = nanoseconds // NANOSECONDS_PER_DAY
+    return {
+        'Days_since_start': (nanoseconds - earliest_date) / NANOSECONDS_PER_DAY,
+        'Hour': (nanoseconds // NANOSECONDS_PER_HOUR) % 24,
+        #1970-01-01 was a thursday, which is day 3
+        'Weekday': (whole_days + 3) % 7}
+
 def forecast_prices(cleaned_df, days_to_forecast):
-    #create a list of the dates in the dataframe
-    dates = cleaned_df['Date_time'].tolist()
+    #the earliest and latest dates are found with min and max rather than sorting the whole column
+    dates = cleaned_df['Date_time'].values
+    earliest_date = dates.min()
+    latest_date = dates.max()
     
-    #work out the earliest and latest dates by sorting the dates in the df
-    sorted_dates = cleaned_df['Date_time'].sort_values()
-    sorted_dates_list = sorted_dates.tolist()
-    earliest_date = sorted_dates_list[0]
-    latest_date = sorted_dates_list[-1]
-    
-    days_time_difference = []
-    for date in dates:
-        #work out the total seconds between the first date and the current date
-        difference_seconds = (date - earliest_date).total_seconds()
-        #convert seconds into days for the days difference
-        difference_days = difference_seconds / (24 * 60 * 60)  
-        days_time_difference.append(difference_days)    
-    
-    #reshape the time differences to be in an array and between -1 and 1
-    x = np.array(days_time_difference)
-    X = x.reshape(-1, 1)
+    #the days between the first date and every date, as an array with one column for the model
+    X = time_features(dates, earliest_date)['Days_since_start'].reshape(-1, 1)
     #reshape the cleaned_df prices into an array
     Y = np.array(cleaned_df["Price"])
     
@@ -99,17 +164,7 @@ def forecast_prices(cleaned_df, days_to_forecast):
     future_dates = future_dates_including_latest[1:]
     
     #same logic as earlier applied to the future days
-    future_time_difference = []
-    for date in future_dates:
-        #work out the total seconds between the first date and the current future date
-        difference_seconds = (date - earliest_date).total_seconds()
-        #convert seconds into days for the days difference
-        difference_days = difference_seconds / (24 * 60 * 60)
-        future_time_difference.append(difference_days)
-    
-    #reshape the future days into an array and between values 1 and -1
-    x_future = np.array(future_time_difference)
-    X_future = x_future.reshape(-1, 1)
+    X_future = time_features(future_dates, earliest_date)['Days_since_start'].reshape(-1, 1)
     
     #use the model to predict price values for these days
     future_prices = model.predict(X_future)
@@ -138,27 +193,19 @@ def Show_about_page():
         st.image("C:/Users/paddy/OneDrive - Lancing College/NEA/code/Image for the about page/market prices visualiser 2.png", caption="Market Prices Visualizer Example", width=1000)
 
 def Show_graphing_page():
-    #read the data from the database into a dataframe
+    #read the item names and the date range from the database, the prices are only read once the items and dates are chosen
     db_path = os.path.join(base_path, 'Output Files', 'Market_prices_cleaned_all.db')
-    cleaned_df = Read_db_to_df(db_path, "Cleaned_market_prices")
+    items_and_dates = Read_items_and_dates(db_path, "Cleaned_market_prices")
     
     #checks if the database is not empty
-    if cleaned_df is not None:
-        #renames the columns of the dataframe ready for graphing
-        market_prices_df = pd.DataFrame({"Name": cleaned_df['Item_name'],"Date": pd.to_datetime(cleaned_df['Date_time']),"Price": cleaned_df['Price']})
+    if items_and_dates is not None:
+        items_to_select, earliest_date, latest_date = items_and_dates
         
         #sets up the page name, title, layout and sidebar
         st.set_page_config(page_title="Price Data Visualizer", layout="wide") #sets up the page
         st.title("Historical Market Prices")
         st.sidebar.header("Graphs Settings")
         
-        #sort the dataframe so that you can find the earliest and latest date time values
-        sorted_df = market_prices_df.sort_values(by='Date')
-        earliest_date = sorted_df.iloc[0]['Date']
-        #earliest_date = earliest_date.date()
-        latest_date = sorted_df.iloc[-1]['Date']
-        #latest_date = latest_date.date()
-        
         #set default date range to the whole dataset and set max and min date values
         date_range = st.sidebar.date_input("Select Date Range", value = (earliest_date, latest_date), min_value = earliest_date, max_value = latest_date, key="date_range")
         
@@ -167,12 +214,11 @@ def Show_graphing_page():
         end_date = pd.to_datetime(date_range[-1])
 
         #sets up the multiselect in the sidebar by creating a list of items to select, then creating the multiselect option 
-        #and then filtering the dataframe to only include these items
-        items_to_select = market_prices_df["Name"].unique().tolist()
+        #and then reading only these items between the chosen dates out of the database
         currently_selected_items = st.sidebar.multiselect("Select Items to Graph", options = items_to_select, default = [items_to_select[0]])
-        filtered_market_prices = market_prices_df[(market_prices_df["Name"].isin(currently_selected_items))]
-        #filters further to include only correct dates
-        filtered_market_prices_dates = filtered_market_prices[(filtered_market_prices['Date'] >= start_date) & (filtered_market_prices['Date'] <= end_date)]
+        cleaned_df = Query_prices(db_path, "Cleaned_market_prices", items = currently_selected_items, start = start_date, end = end_date)
+        #renames the columns of the dataframe ready for graphing
+        filtered_market_prices_dates = pd.DataFrame({"Name": cleaned_df['Item_name'], "Date": cleaned_df['Date_time'], "Price": cleaned_df['Price']})
         
         
         #once again checks if the dataframe is empty and then graphs the data using plotly.express
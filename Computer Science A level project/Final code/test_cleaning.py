@@ -0,0 +1,154 @@
+import importlib.util
+import os
+import tempfile
+import warnings
+import numpy as np
+import pandas as pd
+
+#the backend file has a space in its name so it is loaded from its path rather than imported by name
+final_code_path = os.path.dirname(os.path.abspath(__file__))
+spec = importlib.util.spec_from_file_location("backend", os.path.join(final_code_path, "Backend code.py"))
+backend = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(backend)
+
+price_files_path = os.path.join(final_code_path, "..", "..", "Price Files for A level project")
+
+def random_series():
+    #random prices of every length from empty up to 1000, the same kind of prices the scraper saves
+    rng = np.random.default_rng(0)
+    for length in [0, 1, 2, 3, 5, 10, 21, 50, 200, 1000]:
+        yield rng.integers(150, 9000, length).tolist()
+
+def bundled_series():
+    #the prices of each item in the bundled price files, in date order
+    df = backend.read_directory_to_df(price_files_path)
+    if df is None or df.empty:
+        return
+    df = df.sort_values(['Item_name', 'Date_time'])
+    for item, group in df.groupby('Item_name', observed=True):
+        yield group['Price'].tolist()
+
+def slow_rolling_means(prices, window_size):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.array([backend.calculate_stats(prices, index, window_size) for index in range(len(prices))], dtype=float)
+
+def test_rolling_mean_matches_calculate_stats():
+    #the fast rolling mean has to give the same answer as calculate_stats for every point
+    for prices in random_series():
+        for window_size in [0, 1, 3, 10, 25]:
+            fast_means = backend.rolling_mean_excluding_centre(prices, window_size)
+            assert np.allclose(fast_means, slow_rolling_means(prices, window_size), equal_nan=True), (len(prices), window_size)
+
+def test_rolling_mean_matches_calculate_stats_on_price_files():
+    for prices in bundled_series():
+        fast_means = backend.rolling_mean_excluding_centre(prices, 10)
+        assert np.allclose(fast_means, slow_rolling_means(prices, 10), equal_nan=True)
+
+def slow_smoothing(prices):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.array(backend.clean_group(list(prices)), dtype=float)
+
+def test_legacy_smoothing_matches_clean_group():
+    #the fast legacy smoothing has to give the same answers as clean_group, which always uses a window of 10
+    for prices in random_series():
+        assert np.allclose(backend.smooth_prices(prices, 10, mode="legacy"), slow_smoothing(prices), equal_nan=True), len(prices)
+
+def test_legacy_smoothing_matches_clean_group_on_price_files():
+    for prices in bundled_series():
+        assert np.allclose(backend.smooth_prices(prices, 10, mode="legacy"), slow_smoothing(prices), equal_nan=True)
+
+def slow_hampel(prices, window_size, threshold=3.0):
+    #works out the median and MAD of every window from scratch, leaving out missing prices
+    values = np.asarray(prices, dtype=float)
+    cleaned = values.copy()
+    starts, ends = backend.window_bounds(len(values), window_size)
+    for index in range(len(values)):
+        window = values[starts[index]:ends[index]]
+        window = window[~np.isnan(window)]
+        if len(window) == 0:
+            continue
+        local_median = np.median(window)
+        if abs(values[index] - local_median) > threshold * 1.4826 * np.median(np.abs(window - local_median)):
+            cleaned[index] = local_median
+    return cleaned
+
+def test_hampel_filter_matches_brute_force():
+    #the prices are on a coarse ladder so there are lots of ties, and some are missing like after smoothing a lone price
+    rng = np.random.default_rng(1)
+    for prices in random_series():
+        prices = (np.asarray(prices, dtype=float) // 500) * 500
+        if len(prices) > 3:
+            prices[rng.integers(0, len(prices), len(prices) // 4)] = np.nan
+        for window_size in [0, 1, 3, 10]:
+            assert np.array_equal(backend.hampel_filter(prices, window_size), slow_hampel(prices, window_size), equal_nan=True), (len(prices), window_size)
+
+def test_snapped_prices_can_be_upserted():
+    #an item with one price has nothing in its window so its cleaned price is missing, and snapping to the price ladder
+    #then gives a nullable Int32 column which still has to be written to the database
+    df = pd.DataFrame({
+        'Item_name': ['Anchor'] * 5 + ['Basic'],
+        'Date_time': pd.to_datetime(['2024-01-01 05:09:04', '2024-01-01 06:09:04', '2024-01-01 07:09:04',
+                                     '2024-01-01 08:09:04', '2024-01-01 09:09:04', '2024-01-01 05:09:04']),
+        'Price': [1100, 1250, 1400, 1150, 1300, 700]})
+    cleaned_df = backend.clean_all_data(df, snap_to_ladder=True)
+    assert cleaned_df['Price'].isna().any()
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "prices.db")
+        assert backend.upsert_df_to_db(cleaned_df, db_path, "Cleaned_market_prices")
+        stored_df = backend.query_prices(db_path, table_name="Cleaned_market_prices")
+    assert len(stored_df) == len(cleaned_df)
+    expected = cleaned_df.sort_values(['Item_name', 'Date_time'])['Price'].astype(float).to_numpy()
+    assert np.array_equal(stored_df['Price'].to_numpy(dtype=float), expected, equal_nan=True)
+
+def test_incremental_cleaning_matches_full_clean():
+    #the cleaned prices and trend totals kept up to date as files arrive have to be the same as cleaning and fitting
+    #everything again, when files are added at the end, a late file is added in the middle and a file is changed
+    file_names = backend.list_csv_files(price_files_path)
+    if len(file_names) < 40:
+        return
+    late_file, changed_file = file_names[30], file_names[20]
+    first_files = [file_name for file_name in file_names[:-5] if file_name != late_file]
+    for strategy in ["legacy", "hampel"]:
+        with tempfile.TemporaryDirectory() as directory:
+            files_path = os.path.join(directory, "files")
+            os.mkdir(files_path)
+            db_path = os.path.join(directory, "prices.db")
+            def add_files(names):
+                for file_name in names:
+                    with open(os.path.join(price_files_path, file_name), "rb") as source, open(os.path.join(files_path, file_name), "wb") as copy:
+                        copy.write(source.read())
+            def change_file(file_name):
+                file_path = os.path.join(files_path, file_name)
+                file_df = pd.read_csv(file_path)
+                file_df['price'] = file_df['price'] + 350
+                file_df.iloc[1:].to_csv(file_path, index=False)
+                os.utime(file_path, (0, 0))
+            
+            for step in [lambda: add_files(first_files), lambda: add_files(file_names[-5:]), lambda: add_files([late_file]), lambda: change_file(changed_file)]:
+                step()
+                assert backend.ingest_new_files(files_path, db_path) is not None
+                assert backend.update_cleaned_tail(db_path, strategy) is not None
+                assert backend.update_trend_stats(db_path) is not None
+                
+                raw_df = backend.query_prices(db_path)
+                expected_df = backend.clean_all_data(raw_df, strategy).sort_values(['Item_name', 'Date_time'], ignore_index=True)
+                cleaned_df = backend.query_prices(db_path, table_name="Cleaned_market_prices")
+                assert cleaned_df['Item_name'].tolist() == expected_df['Item_name'].astype(str).tolist()
+                assert (cleaned_df['Date_time'].to_numpy() == expected_df['Date_time'].to_numpy()).all()
+                assert np.allclose(cleaned_df['Price'].to_numpy(dtype=float), expected_df['Price'].to_numpy(dtype=float), equal_nan=True)
+                
+                expected_trends = backend.fit_trends(cleaned_df)
+                trends = backend.read_trend_stats(db_path)
+                assert trends['Item_name'].tolist() == expected_trends['Item_name'].tolist()
+                assert (trends['Start_date'].to_numpy() == expected_trends['Start_date'].to_numpy()).all()
+                assert (trends['Points'].to_numpy() == expected_trends['Points'].to_numpy()).all()
+                assert np.allclose(trends['Slope'], expected_trends['Slope']) and np.allclose(trends['Intercept'], expected_trends['Intercept'])
+
+if __name__ == "__main__":
+    #the tests can be run with pytest, or by running this file on its own
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name} passed")